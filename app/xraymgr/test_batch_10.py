@@ -13,9 +13,10 @@ import threading
 import time
 import uuid
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, replace
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Sequence, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
 
 _THIS = Path(__file__).resolve()
 _PKG = _THIS.parent
@@ -83,6 +84,28 @@ def stop_file_exists(p: str) -> bool:
         return False
 
 
+class StopWatcher:
+    """بررسی stop-file با cache کوتاه؛ در حلقه‌های داغ هر بار stat() نمی‌زند."""
+
+    __slots__ = ("path", "_min_interval", "_last_check", "_known")
+
+    def __init__(self, path: str, min_interval: float = 0.2) -> None:
+        self.path = path
+        self._min_interval = float(min_interval)
+        self._last_check = 0.0
+        self._known = False
+
+    def poll(self) -> bool:
+        if not self.path:
+            return False
+        now = time.monotonic()
+        if self._known or (now - self._last_check) < self._min_interval:
+            return self._known
+        self._last_check = now
+        self._known = stop_file_exists(self.path)
+        return self._known
+
+
 def resolve_db_path(cli_db: str) -> str:
     p = (cli_db or "").strip()
     if p:
@@ -108,6 +131,27 @@ def db_connect(db_path: str) -> sqlite3.Connection:
     return c
 
 
+_READ_CONN: Optional[sqlite3.Connection] = None
+_READ_CONN_LOCK = threading.Lock()
+
+
+def read_connect(db_path: str) -> sqlite3.Connection:
+    """اتصال خواندنیِ مشترک برای COUNTهای دوره‌ای؛ page cache بزرگ‌تر و بین batchها گرم می‌ماند."""
+    global _READ_CONN
+    with _READ_CONN_LOCK:
+        if _READ_CONN is None:
+            c = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+            c.row_factory = sqlite3.Row
+            try:
+                c.execute("PRAGMA busy_timeout=30000;")
+                c.execute("PRAGMA query_only=1;")
+                c.execute("PRAGMA cache_size=-65536;")
+            except Exception:
+                pass
+            _READ_CONN = c
+        return _READ_CONN
+
+
 def table_exists(c: sqlite3.Connection, name: str) -> bool:
     return c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?;", (name,)).fetchone() is not None
 
@@ -250,27 +294,30 @@ def select_links(
         tuple(params + [int(limit)]),
     ).fetchall()
 
-    for r in rows:
-        lid = int(r["id"])
-        sets, args = [], []
-        if "test_status" in links_cols:
-            sets.append("test_status='running'")
-        if "test_started_at" in links_cols:
-            sets.append("test_started_at=?")
-            args.append(now_s)
-        if "test_lock_until" in links_cols:
-            sets.append("test_lock_until=?")
-            args.append(lock_until)
-        if "test_lock_owner" in links_cols:
-            sets.append("test_lock_owner=?")
-            args.append(owner)
-        if "test_batch_id" in links_cols:
-            sets.append("test_batch_id=?")
-            args.append(batch_id)
-
-        if sets:
-            args.append(lid)
-            conn.execute(f"UPDATE links SET {', '.join(sets)} WHERE id=?", tuple(args))
+    if not rows:
+        return rows
+
+    # مقدار SET برای همه سطرها یکسان است؛ یک UPDATE گروهی به جای N اجرای تکی
+    sets, args = [], []
+    if "test_status" in links_cols:
+        sets.append("test_status='running'")
+    if "test_started_at" in links_cols:
+        sets.append("test_started_at=?")
+        args.append(now_s)
+    if "test_lock_until" in links_cols:
+        sets.append("test_lock_until=?")
+        args.append(lock_until)
+    if "test_lock_owner" in links_cols:
+        sets.append("test_lock_owner=?")
+        args.append(owner)
+    if "test_batch_id" in links_cols:
+        sets.append("test_batch_id=?")
+        args.append(batch_id)
+
+    if sets:
+        ids = [int(r["id"]) for r in rows]
+        q = ",".join(["?"] * len(ids))
+        conn.execute(f"UPDATE links SET {', '.join(sets)} WHERE id IN ({q})", tuple(args + ids))
     return rows
 
 
@@ -630,29 +677,102 @@ def extract_ip_fields(res: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]
 
 
 def p(line: str) -> None:
+    # بدون flush؛ زیر پنل با `python -u` اجرا می‌شود و خط‌ها بلافاصله می‌روند.
+    # برای اجرای دستی، flush_stdout در مرزهای batch صدا زده می‌شود.
     print(line)
-    sys.stdout.flush()
 
 
-def run_batch(
+def flush_stdout() -> None:
+    try:
+        sys.stdout.flush()
+    except Exception:
+        pass
+
+
+@dataclass(frozen=True, slots=True)
+class RunConfig:
+    """تنظیمات ثابتِ یک اجرای تست؛ یک بار بعد از argparse ساخته می‌شود و بین batchها مشترک است."""
+
+    db_path: str
+    count: int
+    parallel: int
+    port_start: int
+    tag_prefix: str
+    lock_timeout: int
+    check_timeout: int
+    socks_user: str
+    socks_pass: str
+    socks_listen: str
+    xray_bin: str
+    api_server: str
+    owner: str
+    stop_file: str
+
+
+def _safe_bulk_remove(
+    applier: Any,
     *,
-    db_path: str,
-    count: int,
+    rules: Iterable[str],
+    inbounds: Iterable[str],
+    outbounds: Iterable[str],
     parallel: int,
-    port_start: int,
-    tag_prefix: str,
-    lock_timeout: int,
-    check_timeout: int,
-    socks_user: str,
-    socks_pass: str,
-    socks_listen: str,
-    xray_bin: str,
-    api_server: str,
-    owner: str,
+) -> None:
+    """حذف گروهی منابع runtime در پایان batch؛ خطاها مثل قبل نادیده گرفته می‌شوند."""
+    rules = list(rules)
+    inbounds = list(inbounds)
+    outbounds = list(outbounds)
+    if not (rules or inbounds or outbounds):
+        return
+    with ThreadPoolExecutor(max_workers=max(1, int(parallel))) as ex:
+        futures = []
+        if rules:
+            futures.append(ex.submit(applier.remove_rules, rules, ignore_not_found=True))
+        if inbounds:
+            futures.append(ex.submit(applier.remove_inbounds, inbounds, ignore_not_found=True))
+        if outbounds:
+            futures.append(ex.submit(applier.remove_outbounds, outbounds, ignore_not_found=True))
+        for fut in as_completed(futures):
+            try:
+                fut.result()
+            except Exception:
+                pass
+
+
+def make_applier(cfg: RunConfig) -> Any:
+    """یک applier طولانی‌عمر می‌سازد که بین batchهای یک slot مشترک است."""
+    if XrayRuntimeApplier is None:
+        raise RuntimeError("XrayRuntimeApplier import failed")
+    return XrayRuntimeApplier(
+        xray_bin=cfg.xray_bin,
+        api_server=cfg.api_server,
+        exist_retry=True,
+        command_timeout_sec=20.0,
+        api_probe_timeout_sec=3.0,
+    )
+
+
+def run_batch(
+    cfg: RunConfig,
+    *,
     batch_id: str,
-    stop_file: str,
+    eligible_hint: Optional[int] = None,
+    applier: Optional[Any] = None,
 ) -> Tuple[bool, Dict[str, Any]]:
-    if _STOP.is_set() or stop_file_exists(stop_file):
+    db_path = cfg.db_path
+    count = cfg.count
+    parallel = cfg.parallel
+    port_start = cfg.port_start
+    tag_prefix = cfg.tag_prefix
+    lock_timeout = cfg.lock_timeout
+    check_timeout = cfg.check_timeout
+    socks_user = cfg.socks_user
+    socks_pass = cfg.socks_pass
+    socks_listen = cfg.socks_listen
+    owner = cfg.owner
+    stop_file = cfg.stop_file
+    stop = StopWatcher(stop_file)
+
+    if _STOP.is_set() or stop.poll():
         _set_stop(_STOP_REASON or "stop")
         return False, {"status": "stopped"}
 
@@ -668,7 +788,11 @@ def run_batch(
     with db_connect(db_path) as c:
         ensure_schema_minimal(c)
         lcols = set(cols(c, "links"))
-        eligible_total = count_eligible_links(c, lcols)
+        # در حالت continuous شمارش کامل هر batch گران است؛ اگر caller مقدار cache شده بدهد، COUNT را رد می‌کنیم
+        if eligible_hint is None:
+            eligible_total = count_eligible_links(read_connect(db_path), lcols)
+        else:
+            eligible_total = max(0, int(eligible_hint))
 
         c.execute("BEGIN IMMEDIATE")
         try:
@@ -684,6 +808,10 @@ def run_batch(
             c.rollback()
             raise
 
+    if n == 0:
+        # batch خالی (DB بدون لینک آماده)؛ بدون لاگ و بدون applier برگرد تا حلقه بیرونی idle-sleep کند
+        return False, {"status": "idle", "eligible": eligible_total, "tested": 0, "ok": 0, "fail": 0}
+
     tested = 0
     ok = 0
     fail = 0
@@ -691,17 +819,13 @@ def run_batch(
 
     p(f"PROGRESS eligible={eligible_total} tested={tested} ok={ok} fail={fail}")
 
-    applier = XrayRuntimeApplier(
-        xray_bin=xray_bin,
-        api_server=api_server,
-        exist_retry=True,
-        command_timeout_sec=20.0,
-        api_probe_timeout_sec=3.0,
-    )
+    if applier is None:
+        applier = make_applier(cfg)
 
-    created_out: List[str] = []
-    created_in: List[str] = []
-    created_rules: List[str] = []
+    # setها: membership و حذف O(1)؛ ترتیب برای cleanup مهم نیست
+    created_out: set[str] = set()
+    created_in: set[str] = set()
+    created_rules: set[str] = set()
 
     jobs: List[Tuple[int, int, int, str, int, str, str]] = []
 
@@ -710,7 +834,7 @@ def run_batch(
         lcols = set(cols(u, "links"))
 
         for idx, (inb, lnk) in enumerate(zip(inbounds, links), start=1):
-            if _STOP.is_set() or stop_file_exists(stop_file):
+            if _STOP.is_set() or stop.poll():
                 _set_stop(_STOP_REASON or "stop")
                 break
 
@@ -754,7 +878,7 @@ def run_batch(
                 p(f"FAIL idx={idx} link={link_id} reason={oneword(code)}")
                 continue
 
-            created_out.append(out_tag)
+            created_out.add(out_tag)
 
             r2 = applier.add_inbound(socks_inbound(inbound_tag, socks_listen, port, socks_user, socks_pass))
             if not r2.get("ok"):
@@ -762,8 +886,7 @@ def run_batch(
                     applier.remove_outbound(out_tag, ignore_not_found=True)
                 except Exception:
                     pass
-                if out_tag in created_out:
-                    created_out.remove(out_tag)
+                created_out.discard(out_tag)
 
                 u.execute("BEGIN IMMEDIATE")
                 try:
@@ -778,7 +901,7 @@ def run_batch(
                 p(f"FAIL idx={idx} link={link_id} reason=xray")
                 continue
 
-            created_in.append(inbound_tag)
+            created_in.add(inbound_tag)
 
             rr = applier.apply_rules({"routing": {"rules": [rule(rule_tag, inbound_tag, out_tag)]}}, append=True)
             if not rr.get("ok"):
@@ -790,10 +913,8 @@ def run_batch(
                     applier.remove_outbound(out_tag, ignore_not_found=True)
                 except Exception:
                     pass
-                if inbound_tag in created_in:
-                    created_in.remove(inbound_tag)
-                if out_tag in created_out:
-                    created_out.remove(out_tag)
+                created_in.discard(inbound_tag)
+                created_out.discard(out_tag)
 
                 u.execute("BEGIN IMMEDIATE")
                 try:
@@ -808,7 +929,7 @@ def run_batch(
                 p(f"FAIL idx={idx} link={link_id} reason=rule")
                 continue
 
-            created_rules.append(rule_tag)
+            created_rules.add(rule_tag)
 
             u.execute("BEGIN IMMEDIATE")
             try:
@@ -837,12 +958,9 @@ def run_batch(
                     applier.remove_outbound(out_tag, ignore_not_found=True)
                 except Exception:
                     pass
-                if rule_tag in created_rules:
-                    created_rules.remove(rule_tag)
-                if inbound_tag in created_in:
-                    created_in.remove(inbound_tag)
-                if out_tag in created_out:
-                    created_out.remove(out_tag)
+                created_rules.discard(rule_tag)
+                created_in.discard(inbound_tag)
+                created_out.discard(out_tag)
 
                 u.execute("BEGIN IMMEDIATE")
                 try:
@@ -864,7 +982,7 @@ def run_batch(
     def progress_thread() -> None:
         last = 0.0
         while True:
-            if _STOP.is_set() or stop_file_exists(stop_file):
+            if _STOP.is_set() or stop.poll():
                 return
             time.sleep(1.0)
             t = time.time()
@@ -872,6 +990,7 @@ def run_batch(
                 last = t
                 with prog_lock:
                     p(f"PROGRESS eligible={eligible_total} tested={tested} ok={ok} fail={fail}")
+                flush_stdout()
 
     threading.Thread(target=progress_thread, daemon=True).start()
 
@@ -882,7 +1001,7 @@ def run_batch(
         # این خط باعث میشه پنل «بدونه الان چی داره تست میشه»
         p(f"TEST idx={idx} link={link_id} port={port}")
 
-        if _STOP.is_set() or stop_file_exists(stop_file):
+        if _STOP.is_set() or stop.poll():
             return {"skipped": True, "idx": idx, "link_id": link_id, "inbound_id": inbound_id, "reason": _STOP_REASON or "stop"}
 
         res = run_check(check_py, socks5=socks5, timeout_sec=check_timeout)
@@ -964,25 +1083,11 @@ def run_batch(
             else:
                 p(f"FAIL idx={idx} link={link_id} reason={oneword(str(r.get('reason') or 'fail'))}")
 
-    # cleanup runtime resources
-    try:
-        if created_rules:
-            applier.remove_rules(created_rules, ignore_not_found=True)
-    except Exception:
-        pass
-    for t in list(created_in):
-        try:
-            applier.remove_inbound(t, ignore_not_found=True)
-        except Exception:
-            pass
-    for t in list(created_out):
-        try:
-            applier.remove_outbound(t, ignore_not_found=True)
-        except Exception:
-            pass
+    _safe_bulk_remove(applier, rules=created_rules, inbounds=created_in, outbounds=created_out, parallel=parallel)
 
     with prog_lock:
         rep = {"status": "ok", "eligible": eligible_total, "tested": tested, "ok": ok, "fail": fail}
+    flush_stdout()
     return True, rep
 
 
@@ -1007,6 +1112,8 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
     ap.add_argument("--run-id", default="")
     ap.add_argument("--stop-file", default="")
     ap.add_argument("--idle-sleep", type=float, default=2.0)
+    ap.add_argument("--recount-interval", type=int, default=0)
+    ap.add_argument("--batch-parallelism", type=int, default=1)
     ap.add_argument("--max-batches", type=int, default=0)
     ap.add_argument("--continuous", action="store_true")
     ap.add_argument("--once", action="store_true")
@@ -1018,11 +1125,30 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
     count = max(1, int(a.count or 100))
     parallel = max(1, int(a.parallel or 10))
     run_id = (str(a.run_id).strip() or uuid.uuid4().hex)
+    # پیشوند batch_id یک بار؛ داخل حلقه فقط شماره format می‌شود
+    batch_prefix = f"{run_id}-"
 
     stop_file = (str(a.stop_file).strip() or "")
     if stop_file and not os.path.isabs(stop_file):
         stop_file = str(Path(stop_file).expanduser().resolve())
 
+    cfg = RunConfig(
+        db_path=db_path,
+        count=count,
+        parallel=parallel,
+        port_start=int(a.port_start or 9000),
+        tag_prefix=str(a.inbound_tag_prefix or "in_test_"),
+        lock_timeout=int(a.lock_timeout or 90),
+        check_timeout=int(a.check_timeout or 60),
+        socks_user=str(a.socks_user or "me"),
+        socks_pass=str(a.socks_pass or "1"),
+        socks_listen=str(a.socks_listen or "127.0.0.1"),
+        xray_bin=str(a.xray_bin),
+        api_server=str(a.api_server),
+        owner=str(a.owner or "panel"),
+        stop_file=stop_file,
+    )
+
     with db_connect(db_path) as c:
         ensure_schema_minimal(c)
 
@@ -1032,46 +1158,101 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
     batches, total_ok, total_fail, total_tested = 0, 0, 0, 0
     t0 = utc_now()
 
-    while True:
-        if _STOP.is_set() or stop_file_exists(stop_file):
-            _set_stop(_STOP_REASON or "stop")
-            break
-        if continuous and a.max_batches and batches >= int(a.max_batches):
-            break
+    # 0 یعنی هر batch دوباره COUNT بزن؛ N یعنی هر N batch یک بار و بین آن‌ها delta محلی
+    recount_interval = max(0, int(a.recount_interval or 0))
+    eligible_cache: Optional[int] = None
+    batches_since_recount = 0
 
-        batches += 1
-        batch_id = f"{run_id}-{batches:06d}" if continuous else run_id
-
-        had, rep = run_batch(
-            db_path=db_path,
-            count=count,
-            parallel=parallel,
-            port_start=int(a.port_start or 9000),
-            tag_prefix=str(a.inbound_tag_prefix or "in_test_"),
-            lock_timeout=int(a.lock_timeout or 90),
-            check_timeout=int(a.check_timeout or 60),
-            socks_user=str(a.socks_user or "me"),
-            socks_pass=str(a.socks_pass or "1"),
-            socks_listen=str(a.socks_listen or "127.0.0.1"),
-            xray_bin=str(a.xray_bin),
-            api_server=str(a.api_server),
-            owner=str(a.owner or "panel"),
-            batch_id=batch_id,
-            stop_file=stop_file,
-        )
+    stop = StopWatcher(stop_file)
+    batch_par = max(1, int(a.batch_parallelism or 1))
+
+    # حلقه‌های پایین در حالت idle می‌توانند خیلی زیاد بچرخند؛ lookup روی namespace را یک بار انجام بده
+    max_batches = int(a.max_batches or 0)
+    idle_sleep = max(0.2, float(a.idle_sleep or 2.0))
 
+    def _next_hint() -> Optional[int]:
+        if recount_interval <= 0 or eligible_cache is None or batches_since_recount >= recount_interval:
+            return None
+        return eligible_cache
+
+    def _account(rep: Dict[str, Any], used_hint: Optional[int]) -> None:
+        nonlocal total_ok, total_fail, total_tested, eligible_cache, batches_since_recount
+        batch_tested = int(rep.get("tested", 0) or 0)
         total_ok += int(rep.get("ok", 0) or 0)
         total_fail += int(rep.get("fail", 0) or 0)
-        total_tested += int(rep.get("tested", 0) or 0)
+        total_tested += batch_tested
+        if used_hint is None:
+            eligible_cache = int(rep.get("eligible", 0) or 0)
+            batches_since_recount = 0
+        else:
+            batches_since_recount += 1
+        eligible_cache = max(0, int(eligible_cache or 0) - batch_tested)
+
+    if continuous and batch_par > 1:
+        # چند batch همزمان؛ هر slot پنجره پورت جداگانه دارد تا inboundها تداخل نکنند
+        free_slots = list(range(batch_par))
+        inflight: Dict[Any, Tuple[int, Optional[int]]] = {}
+        slot_appliers: Dict[int, Any] = {}
+
+        def _submit(pool: ThreadPoolExecutor) -> bool:
+            nonlocal batches
+            if _STOP.is_set() or stop.poll():
+                return False
+            if max_batches and batches >= max_batches:
+                return False
+            if not free_slots:
+                return False
+            slot = free_slots.pop()
+            batches += 1
+            batch_id = f"{batch_prefix}{batches:06d}"
+            hint = _next_hint()
+            slot_cfg = cfg if slot == 0 else replace(cfg, port_start=cfg.port_start + slot * cfg.count)
+            if slot not in slot_appliers:
+                slot_appliers[slot] = make_applier(slot_cfg)
+            fut = pool.submit(run_batch, slot_cfg, batch_id=batch_id, eligible_hint=hint, applier=slot_appliers[slot])
+            inflight[fut] = (slot, hint)
+            return True
+
+        with ThreadPoolExecutor(max_workers=batch_par) as pool:
+            while True:
+                while _submit(pool):
+                    pass
+                if not inflight:
+                    break
+                fut = next(as_completed(tuple(inflight)))
+                slot, used_hint = inflight.pop(fut)
+                free_slots.append(slot)
+                try:
+                    had, rep = fut.result()
+                except Exception as e:
+                    had, rep = False, {"status": "error", "error": str(e)}
+                _account(rep, used_hint)
+                if not had and not inflight:
+                    time.sleep(idle_sleep)
+    else:
+        applier = make_applier(cfg)
+        while True:
+            if _STOP.is_set() or stop.poll():
+                _set_stop(_STOP_REASON or "stop")
+                break
+            if continuous and max_batches and batches >= max_batches:
+                break
 
-        if not continuous:
-            break
+            batches += 1
+            batch_id = f"{batch_prefix}{batches:06d}" if continuous else run_id
 
-        if not had:
-            time.sleep(max(0.2, float(a.idle_sleep)))
-            continue
+            eligible_hint = _next_hint()
+            had, rep = run_batch(cfg, batch_id=batch_id, eligible_hint=eligible_hint, applier=applier)
+            _account(rep, eligible_hint)
+
+            if not continuous:
+                break
+
+            if not had:
+                time.sleep(idle_sleep)
+                continue
 
-        time.sleep(0.1)
+            time.sleep(0.1)
 
     dur = (utc_now() - t0).total_seconds()
     print(f"GLOBAL batches={batches} tested={total_tested} ok={total_ok} fail={total_fail} duration={dur:.2f}s stop={_STOP_REASON}")
@@ -1,8 +1,15 @@
 from __future__ import annotations
 
-import contextlib
+import asyncio
+import collections
+import concurrent.futures
+import copy
+import functools
+import hashlib
 import json
 import os
+import queue
+import re
 import shutil
 import sqlite3
 import subprocess
@@ -11,11 +18,12 @@ import tempfile
 import threading
 import time
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, List, Optional
 
-from fastapi import Body, FastAPI, HTTPException, Query
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import Body, FastAPI, HTTPException, Query, Request, WebSocket
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from pydantic import BaseModel
+from starlette.middleware.gzip import GZipMiddleware
 from starlette.staticfiles import StaticFiles
 
 from .collector import SubscriptionCollector
@@ -31,8 +39,39 @@ try:
 except Exception:  # pragma: no cover
     JsonRepairUpdater = None  # type: ignore
 
+try:
+    import orjson  # type: ignore
+except Exception:  # pragma: no cover
+    orjson = None  # type: ignore
+
+
+if orjson is not None:
+
+    class ORJSONResponse(JSONResponse):
+        media_type = "application/json"
+
+        def render(self, content: Any) -> bytes:
+            return orjson.dumps(content)
+
+    DefaultJSONResponse = ORJSONResponse
+else:
+    DefaultJSONResponse = JSONResponse
+
+
+def _json_loads(raw: Any) -> Any:
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+def _dump_settings_text(obj: Dict[str, Any]) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode("utf-8") + "\n"
+    return json.dumps(obj, ensure_ascii=False, indent=2) + "\n"
+
 
-app = FastAPI(title="XrayMgr Web Dashboard")
+app = FastAPI(title="XrayMgr Web Dashboard", default_response_class=DefaultJSONResponse)
+
+# لاگ‌ها متن ASCII تکراری‌اند و ~۱۰× فشرده می‌شوند؛ پاسخ‌های کوچک دست نمی‌خورند
+app.add_middleware(GZipMiddleware, minimum_size=512)
 
 BASE_DIR = Path(__file__).resolve().parent
 INDEX_HTML_PATH = BASE_DIR / "web_static" / "index.html"
@@ -77,13 +116,19 @@ DEFAULT_SETTINGS: Dict[str, Any] = {
 }
 
 
+# فایل‌هایی که hash محتوا در اسمشان است هرگز عوض نمی‌شوند؛ می‌توانند برای همیشه cache شوند
+_HASHED_ASSET_RE = re.compile(r".+\.[0-9a-f]{8,}\.(?:js|css|woff2?|png|svg)$")
+
+
 class NoCacheStaticFiles(StaticFiles):
     async def get_response(self, path: str, scope):
         resp = await super().get_response(path, scope)
         if resp.status_code == 200:
-            resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
-            resp.headers["Pragma"] = "no-cache"
-            resp.headers["Expires"] = "0"
+            if _HASHED_ASSET_RE.match(path):
+                resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+            else:
+                # no-cache (نه no-store): مرورگر revalidate می‌کند و با ETag استارلت 304 می‌گیرد
+                resp.headers["Cache-Control"] = "no-cache"
         return resp
 
 
@@ -93,15 +138,126 @@ app.mount("/static", NoCacheStaticFiles(directory=STATIC_DIR), name="static")
 # ----------------- DB helpers -----------------
 
 
-def get_connection() -> sqlite3.Connection:
+# journal_mode=WAL روی فایل DB ماندگار است؛ یک بار در هر پروسه کافی است
+_wal_applied = False
+
+
+@functools.lru_cache(maxsize=1)
+def _cached_db_path() -> str:
+    # مسیر DB در طول عمر پروسه عوض نمی‌شود؛ endpointهای polling هر بار دنبالش نمی‌گردند
+    return get_db_path()
+
+
+def get_connection(*, check_same_thread: bool = True) -> sqlite3.Connection:
+    global _wal_applied
     db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
+    # cached_statements بزرگ‌تر: کوئری‌های preset و pollingها دوباره parse/plan نمی‌شوند
+    conn = sqlite3.connect(db_path, timeout=5.0, check_same_thread=check_same_thread, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    try:
+        if not _wal_applied:
+            conn.execute("PRAGMA journal_mode=WAL;")
+            _wal_applied = True
+        conn.executescript(
+            "PRAGMA synchronous=NORMAL;"
+            "PRAGMA temp_store=MEMORY;"
+            "PRAGMA cache_size=-20000;"
+            "PRAGMA busy_timeout=5000;"
+            "PRAGMA mmap_size=268435456;"
+        )
+    except Exception:
+        pass
     return conn
 
 
+# دو استخر اتصال: N خواننده (mode=ro) + یک نویسنده؛ هر request دیگر connect/close نمی‌زند
+_READ_POOL_SIZE = max(2, os.cpu_count() or 2)
+_read_pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+_write_pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+_pool_lock = threading.Lock()
+_pool_counts = {"ro": 0, "rw": 0}
+# شمارنده‌های ساده برای /db/pool-health
+_pool_stats = {"acquisitions": 0, "wait_total_s": 0.0}
+
+
+def _open_pool_connection(readonly: bool) -> sqlite3.Connection:
+    if readonly:
+        db_path = get_db_path()
+        try:
+            conn = sqlite3.connect(
+                f"file:{db_path}?mode=ro", uri=True, timeout=5.0, check_same_thread=False, cached_statements=256
+            )
+        except sqlite3.OperationalError:
+            # فایل DB هنوز ساخته نشده؛ اتصال rw باز می‌کنیم ولی فقط برای خواندن استفاده می‌شود
+            conn = sqlite3.connect(db_path, timeout=5.0, check_same_thread=False, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.executescript(
+                "PRAGMA query_only=1;"
+                "PRAGMA busy_timeout=5000;"
+                "PRAGMA cache_size=-20000;"
+                "PRAGMA mmap_size=268435456;"
+            )
+        except Exception:
+            pass
+        return conn
+    return get_connection(check_same_thread=False)
+
+
+def _checkout_connection(readonly: bool) -> sqlite3.Connection:
+    pool = _read_pool if readonly else _write_pool
+    key = "ro" if readonly else "rw"
+    limit = _READ_POOL_SIZE if readonly else 1
+    with _pool_lock:
+        _pool_stats["acquisitions"] += 1
+    try:
+        return pool.get_nowait()
+    except queue.Empty:
+        pass
+    with _pool_lock:
+        if _pool_counts[key] < limit:
+            _pool_counts[key] += 1
+            return _open_pool_connection(readonly)
+    t0 = time.monotonic()
+    conn = pool.get()
+    with _pool_lock:
+        _pool_stats["wait_total_s"] += time.monotonic() - t0
+    return conn
+
+
+def _checkin_connection(conn: sqlite3.Connection, readonly: bool) -> None:
+    (_read_pool if readonly else _write_pool).put(conn)
+
+
+# فقط pragmaهای introspection خالص به pool خواندنی می‌روند؛ بقیه (wal_checkpoint،
+# journal_mode، busy_timeout و…) یا state نشستِ اتصال مشترک را عوض می‌کنند یا روی
+# اتصال query_only شکست می‌خورند و باید به writer بروند
+_READONLY_PRAGMAS = frozenset({
+    "table_info", "table_xinfo", "table_list", "index_list", "index_info",
+    "foreign_key_list", "database_list", "function_list", "collation_list",
+    "compile_options", "integrity_check", "quick_check", "freelist_count",
+    "page_count",
+})
+
+
+def _is_read_only_sql(query: str) -> bool:
+    head = (query or "").lstrip().split(None, 1)
+    tok = head[0].lower() if head else ""
+    if tok in ("select", "explain", "values"):
+        return True
+    if tok == "pragma":
+        rest = head[1] if len(head) > 1 else ""
+        m = re.match(r"(?:\w+\s*\.\s*)?(\w+)", rest)
+        return bool(m) and m.group(1).lower() in _READONLY_PRAGMAS and "=" not in rest
+    # CTE: فقط اگر بدنه DML نداشته باشد خواندنی است؛ در شک، مسیر writer امن است
+    if tok == "with":
+        return re.search(r"\b(insert|update|delete|replace)\b", query, re.IGNORECASE) is None
+    return False
+
+
 def run_query(query: str, params: Optional[List[Any]] = None) -> Dict[str, Any]:
-    conn = get_connection()
+    readonly = _is_read_only_sql(query)
+    conn = _checkout_connection(readonly)
     try:
         cur = conn.cursor()
         if params:
@@ -111,16 +267,31 @@ def run_query(query: str, params: Optional[List[Any]] = None) -> Dict[str, Any]:
 
         if cur.description:
             columns = [d[0] for d in cur.description]
-            rows = cur.fetchall()
-            data_rows = [dict(zip(columns, row)) for row in rows]
+            # ردیف‌ها به صورت ستونی (لیست مقادیر)؛ نه dict-per-row و نه تکرار نام ستون در payload
+            # fetchmany دسته‌ای: کل نتیجه و نسخه تبدیل‌شده هم‌زمان در حافظه نمی‌مانند
+            cur.arraysize = 1000
+            data_rows: List[Any] = []
+            while True:
+                batch = cur.fetchmany()
+                if not batch:
+                    break
+                data_rows.extend(map(list, batch))
         else:
             columns = []
             data_rows = []
 
-        conn.commit()
+        if not readonly:
+            conn.commit()
         return {"columns": columns, "rows": data_rows, "rowcount": cur.rowcount}
+    except Exception:
+        if not readonly:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+        raise
     finally:
-        conn.close()
+        _checkin_connection(conn, readonly)
 
 
 # ----------------- Settings helpers -----------------
@@ -129,35 +300,60 @@ def run_query(query: str, params: Optional[List[Any]] = None) -> Dict[str, Any]:
 _settings_lock = threading.Lock()
 _settings_cache: Optional[Dict[str, Any]] = None
 _settings_cache_mtime: Optional[float] = None
+_settings_last_check: float = 0.0
+
+# تا این فاصله بعد از آخرین stat()، همان cache را بدون syscall برمی‌گردانیم
+_SETTINGS_CHECK_INTERVAL = 1.0
 
 
 def _deep_merge(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
-    out: Dict[str, Any] = dict(base)
-    for k, v in override.items():
-        if isinstance(v, dict) and isinstance(out.get(k), dict):
-            out[k] = _deep_merge(out[k], v)  # type: ignore[arg-type]
-        else:
-            out[k] = v
+    # یک کپی کامل از base و سپس merge تکرارشونده in-place؛ خروجی هیچ dict داخلی را با base شریک نیست
+    out: Dict[str, Any] = copy.deepcopy(base)
+    stack: List[tuple] = [(out, override)]
+    while stack:
+        dst, src = stack.pop()
+        for k, v in src.items():
+            cur = dst.get(k)
+            if isinstance(v, dict) and isinstance(cur, dict):
+                stack.append((cur, v))
+            else:
+                dst[k] = v
     return out
 
 
-def _settings_path() -> Path:
-    env = os.getenv(SETTINGS_ENV_VAR, "").strip()
+@functools.lru_cache(maxsize=4)
+def _settings_path_for(env: str, db_path: str) -> Path:
     if env:
         return Path(env).expanduser().resolve()
 
-    dbp = Path(get_db_path()).expanduser()
+    dbp = Path(db_path).expanduser()
     if not dbp.is_absolute():
         dbp = (Path.cwd() / dbp).resolve()
     return dbp.parent / SETTINGS_FILE_NAME
 
 
+def _settings_path() -> Path:
+    # ورودی‌ها در عمل ثابت‌اند؛ cache مسیر را بدون syscall برمی‌گرداند
+    return _settings_path_for(os.getenv(SETTINGS_ENV_VAR, "").strip(), get_db_path())
+
+
 def _atomic_write_text(path: Path, text: str) -> None:
+    # write -> fsync فایل -> rename -> fsync دایرکتوری؛ بعد از crash یا نسخه قدیم می‌ماند یا نسخه کامل جدید
     path.parent.mkdir(parents=True, exist_ok=True)
     with tempfile.NamedTemporaryFile("w", delete=False, encoding="utf-8", dir=str(path.parent)) as tf:
         tf.write(text)
-        tmp = Path(tf.name)
-    tmp.replace(path)
+        tf.flush()
+        os.fsync(tf.fileno())
+        tmp_name = tf.name
+    os.replace(tmp_name, str(path))
+    try:
+        dfd = os.open(str(path.parent), os.O_DIRECTORY)
+        try:
+            os.fsync(dfd)
+        finally:
+            os.close(dfd)
+    except OSError:
+        pass
 
 
 def _ensure_settings_file_exists() -> None:
@@ -165,10 +361,21 @@ def _ensure_settings_file_exists() -> None:
     if path.exists():
         return
     merged = dict(DEFAULT_SETTINGS)
-    _atomic_write_text(path, json.dumps(merged, ensure_ascii=False, indent=2) + "\n")
+    _atomic_write_text(path, _dump_settings_text(merged))
 
 
 def load_settings() -> Dict[str, Any]:
+    """
+    تنظیمات merge شده را برمی‌گرداند.
+    خروجی همان dict کش شده است — caller فقط باید بخواند، نه تغییر بدهد.
+    """
+    global _settings_cache, _settings_cache_mtime, _settings_last_check
+
+    now = time.monotonic()
+    with _settings_lock:
+        if _settings_cache is not None and (now - _settings_last_check) < _SETTINGS_CHECK_INTERVAL:
+            return _settings_cache
+
     _ensure_settings_file_exists()
     path = _settings_path()
 
@@ -176,13 +383,14 @@ def load_settings() -> Dict[str, Any]:
     mtime = st.st_mtime
 
     with _settings_lock:
-        global _settings_cache, _settings_cache_mtime
+        _settings_last_check = now
         if _settings_cache is not None and _settings_cache_mtime == mtime:
-            return dict(_settings_cache)
+            return _settings_cache
 
-        raw = path.read_text(encoding="utf-8")
+        # bytes را مستقیم به parser می‌دهیم؛ هم json و هم orjson خودشان decode می‌کنند
+        raw = path.read_bytes()
         try:
-            parsed = json.loads(raw) if raw.strip() else {}
+            parsed = _json_loads(raw) if raw.strip() else {}
         except Exception:
             parsed = {}
 
@@ -192,7 +400,7 @@ def load_settings() -> Dict[str, Any]:
         merged = _deep_merge(DEFAULT_SETTINGS, parsed)
         _settings_cache = merged
         _settings_cache_mtime = mtime
-        return dict(merged)
+        return merged
 
 
 def save_settings(payload: Dict[str, Any]) -> Dict[str, Any]:
@@ -202,12 +410,16 @@ def save_settings(payload: Dict[str, Any]) -> Dict[str, Any]:
     merged = _deep_merge(DEFAULT_SETTINGS, payload)
 
     path = _settings_path()
-    _atomic_write_text(path, json.dumps(merged, ensure_ascii=False, indent=2) + "\n")
+    _atomic_write_text(path, _dump_settings_text(merged))
 
     with _settings_lock:
-        global _settings_cache, _settings_cache_mtime
-        _settings_cache = None
-        _settings_cache_mtime = None
+        global _settings_cache, _settings_cache_mtime, _settings_last_check
+        _settings_cache = merged
+        try:
+            _settings_cache_mtime = path.stat().st_mtime
+        except Exception:
+            _settings_cache_mtime = None
+        _settings_last_check = time.monotonic()
 
     return merged
 
@@ -225,17 +437,13 @@ _STD_PATH_PARTS = [
 ]
 
 
+@functools.lru_cache(maxsize=8)
 def _merged_std_path(base_path: Optional[str]) -> str:
+    # PATH بین فراخوانی‌ها عملاً ثابت است؛ نتیجه per-input کش می‌شود
     parts: List[str] = []
     if base_path:
-        for p in str(base_path).split(":"):
-            p = p.strip()
-            if p and p not in parts:
-                parts.append(p)
-    for p in _STD_PATH_PARTS:
-        if p not in parts:
-            parts.append(p)
-    return ":".join(parts)
+        parts = [p.strip() for p in str(base_path).split(":") if p.strip()]
+    return ":".join(dict.fromkeys(parts + _STD_PATH_PARTS))
 
 
 def _subprocess_env_with_std_path() -> Dict[str, str]:
@@ -271,6 +479,10 @@ def _is_exec_file(p: str) -> bool:
         return False
 
 
+# فقط نتیجه‌های موفق کش می‌شوند و قبل از استفاده دوباره validate می‌شوند (یک stat به جای اسکن PATH)
+_resolve_xray_cache: Dict[tuple, str] = {}
+
+
 def _resolve_xray_bin_for_panel(xray_bin_cfg: str) -> Optional[str]:
     """
     منطق قطعی (بدون auto-discovery چندمسیره):
@@ -286,14 +498,21 @@ def _resolve_xray_bin_for_panel(xray_bin_cfg: str) -> Optional[str]:
     if os.path.isabs(xray_bin_cfg) or "/" in xray_bin_cfg:
         return xray_bin_cfg if _is_exec_file(xray_bin_cfg) else None
 
+    key = (xray_bin_cfg, os.environ.get("PATH", ""))
+    cached = _resolve_xray_cache.get(key)
+    if cached is not None and _is_exec_file(cached):
+        return cached
+
     # اگر کاربر فقط نام داده باشد، فقط PATH همین پروسه را چک می‌کنیم
     merged_path = _merged_std_path(os.environ.get("PATH", ""))
     found = shutil.which(xray_bin_cfg, path=merged_path)
     if found and _is_exec_file(found):
+        _resolve_xray_cache[key] = found
         return found
 
     # fallback ثابت (همان مسیری که شما پیدا کردید)
     if _is_exec_file(XRAY_XUI_DEFAULT):
+        _resolve_xray_cache[key] = XRAY_XUI_DEFAULT
         return XRAY_XUI_DEFAULT
 
     return None
@@ -313,13 +532,37 @@ json_repair_state: Dict[str, Any] = {"name": "json_repair", "running": False, "l
 compress_state: Dict[str, Any] = {"name": "compress", "running": False, "last_started_at": None, "last_finished_at": None, "stats": None, "instance": None}
 test_state: Dict[str, Any] = {"name": "test", "running": False, "last_started_at": None, "last_finished_at": None, "stats": None, "instance": None}
 
-shared_log: List[str] = []
-test_log: List[str] = []
+# deque با maxlen: trim خودکار O(1) به جای del روی list
+shared_log: "collections.deque[str]" = collections.deque(maxlen=MAX_LOG_LINES)
+test_log: "collections.deque[str]" = collections.deque(maxlen=MAX_TEST_LOG_LINES)
+
+# تعداد کل خط‌های نوشته‌شده از آخرین reset؛ offsetهای client با وجود eviction معتبر می‌مانند
+_log_totals = {"collector": 0, "test": 0}
+
+
+# مشترک‌های WebSocket؛ هر کدام یک صف thread-safe دارند چون writerها threadهای job هستند
+_log_subscribers: "set[queue.Queue]" = set()
+
+
+def _broadcast_log_lines(source: str, lines: List[str]) -> None:
+    if not _log_subscribers:
+        return
+    for q in tuple(_log_subscribers):
+        for ln in lines:
+            try:
+                q.put_nowait((source, ln))
+            except queue.Full:
+                # مشترک عقب افتاده؛ بقیه را از مسیر polling جبران می‌کند
+                break
 
 
 class SharedLogStream:
     def __init__(self) -> None:
-        self._buf = ""
+        # تکه‌های بدون newline جمع می‌شوند و فقط موقع رسیدن newline یک بار join می‌شوند.
+        # این instance به‌عنوان sys.stdout کل پروسه نصب می‌شود و jobهای هم‌زمان از
+        # threadهای مختلف write می‌کنند؛ جهش بافر باید زیر قفل باشد
+        self._chunks: List[str] = []
+        self._chunks_lock = threading.Lock()
 
     def write(self, s: str) -> int:
         if s is None:
@@ -330,18 +573,25 @@ class SharedLogStream:
         except Exception:
             pass
 
-        self._buf += text
-        lines = self._buf.split("\n")
-        self._buf = lines[-1]
+        if "\n" not in text:
+            if text:
+                with self._chunks_lock:
+                    self._chunks.append(text)
+            return len(text)
+
+        with self._chunks_lock:
+            joined = "".join(self._chunks) + text if self._chunks else text
+            body, _, tail = joined.rpartition("\n")
+            self._chunks = [tail] if tail else []
 
-        to_add = [ln.rstrip("\r") for ln in lines[:-1]]
+        # آماده‌سازی خارج از قفل؛ داخل قفل فقط یک extend
+        # splitlines خودش \r\n را هضم می‌کند؛ rstrip جداگانه per-line لازم نیست
+        to_add = [ln for ln in body.splitlines() if ln.strip()]
         if to_add:
             with jobs_lock:
-                for ln in to_add:
-                    if ln.strip():
-                        shared_log.append(ln)
-                if len(shared_log) > MAX_LOG_LINES:
-                    del shared_log[: len(shared_log) - MAX_LOG_LINES]
+                shared_log.extend(to_add)
+                _log_totals["collector"] += len(to_add)
+            _broadcast_log_lines("collector", to_add)
         return len(text)
 
     def flush(self) -> None:
@@ -351,14 +601,22 @@ class SharedLogStream:
             pass
 
 
+# redirect_stdout در هر thread سراسری عمل می‌کند و با jobهای هم‌زمان race در restore دارد؛
+# به جایش یک بار stdout پروسه را به لاگ مشترک وصل می‌کنیم (echo به کنسول داخل write هست)
+_SHARED_LOG_STREAM = SharedLogStream()
+sys.stdout = _SHARED_LOG_STREAM
+
+
 def _reset_log() -> None:
     with jobs_lock:
         shared_log.clear()
+        _log_totals["collector"] = 0
 
 
 def _reset_test_log() -> None:
     with jobs_lock:
         test_log.clear()
+        _log_totals["test"] = 0
 
 
 def _append_test_log_line(line: str) -> None:
@@ -367,8 +625,56 @@ def _append_test_log_line(line: str) -> None:
         return
     with jobs_lock:
         test_log.append(ln)
-        if len(test_log) > MAX_TEST_LOG_LINES:
-            del test_log[: len(test_log) - MAX_TEST_LOG_LINES]
+        _log_totals["test"] += 1
+    _broadcast_log_lines("test", [ln])
+
+
+def _append_test_log_lines(lines: Iterable[str]) -> None:
+    # نسخه‌ی دسته‌ای: یک extend زیر قفل به جای قفل/آزاد به ازای هر خط
+    batch = [ln for ln in (str(s).rstrip("\r\n") for s in lines) if ln.strip()]
+    if not batch:
+        return
+    with jobs_lock:
+        test_log.extend(batch)
+        _log_totals["test"] += len(batch)
+    _broadcast_log_lines("test", batch)
+
+
+_JOB_STATES = (
+    collector_state,
+    importer_state,
+    json_state,
+    hash_state,
+    group_state,
+    json_repair_state,
+    compress_state,
+    test_state,
+)
+
+
+def _job_public_state(state: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "running": bool(state["running"]),
+        "last_started_at": state["last_started_at"],
+        "last_finished_at": state["last_finished_at"],
+        "stats": state["stats"],
+    }
+
+
+# snapshot منتشرشده برای /jobs/summary؛ خوانندگان بدون قفل می‌خوانند (جایگزینی dict اتمیک است)
+_jobs_snapshot: Dict[str, Any] = {}
+
+
+def _publish_jobs_snapshot_locked() -> None:
+    """باید زیر jobs_lock صدا زده شود؛ بعد از هر تغییر وضعیت job."""
+    global _jobs_snapshot
+    jobs: Dict[str, Any] = {}
+    any_running = False
+    for s in _JOB_STATES:
+        pub = _job_public_state(s)
+        jobs[s["name"]] = pub
+        any_running = any_running or pub["running"]
+    _jobs_snapshot = {"any_running": any_running, "jobs": jobs}
 
 
 def _mark_job_start(state: Dict[str, Any], instance: Any) -> None:
@@ -378,6 +684,7 @@ def _mark_job_start(state: Dict[str, Any], instance: Any) -> None:
         state["last_finished_at"] = None
         state["stats"] = None
         state["instance"] = instance
+        _publish_jobs_snapshot_locked()
 
 
 def _mark_job_finish(state: Dict[str, Any], stats: Optional[Dict[str, Any]] = None) -> None:
@@ -386,6 +693,11 @@ def _mark_job_finish(state: Dict[str, Any], stats: Optional[Dict[str, Any]] = No
         state["last_finished_at"] = time.time()
         state["stats"] = stats
         state["instance"] = None
+        _publish_jobs_snapshot_locked()
+
+
+with jobs_lock:
+    _publish_jobs_snapshot_locked()
 
 
 def _job_status_payload(state: Dict[str, Any]) -> Dict[str, Any]:
@@ -402,15 +714,14 @@ def _job_status_payload(state: Dict[str, Any]) -> Dict[str, Any]:
 
 
 def _run_collector_thread() -> None:
-    log_stream = SharedLogStream()
+    log_stream = _SHARED_LOG_STREAM
     _reset_log()
 
     collector = SubscriptionCollector()
     _mark_job_start(collector_state, collector)
 
     try:
-        with contextlib.redirect_stdout(log_stream):
-            collector.collect_from_sources_file()
+        collector.collect_from_sources_file()
         _mark_job_finish(collector_state, {"collector_stats": getattr(collector, "stats", None)})
     except Exception as e:
         log_stream.write(f"[collector] FATAL ERROR: {e}\n")
@@ -418,15 +729,14 @@ def _run_collector_thread() -> None:
 
 
 def _run_importer_thread() -> None:
-    log_stream = SharedLogStream()
+    log_stream = _SHARED_LOG_STREAM
     _reset_log()
 
     importer = RawConfigImporter(batch_size=1000)
     _mark_job_start(importer_state, importer)
 
     try:
-        with contextlib.redirect_stdout(log_stream):
-            importer.import_configs()
+        importer.import_configs()
         _mark_job_finish(importer_state, {"importer_stats": getattr(importer, "stats", None)})
     except Exception as e:
         log_stream.write(f"[importer] FATAL ERROR: {e}\n")
@@ -434,15 +744,14 @@ def _run_importer_thread() -> None:
 
 
 def _run_json_thread() -> None:
-    log_stream = SharedLogStream()
+    log_stream = _SHARED_LOG_STREAM
     _reset_log()
 
     updater = JsonConfigUpdater(batch_size=1000)
     _mark_job_start(json_state, updater)
 
     try:
-        with contextlib.redirect_stdout(log_stream):
-            updater.update_missing_json()
+        updater.update_missing_json()
         _mark_job_finish(json_state, {"json_stats": getattr(updater, "stats", None)})
     except Exception as e:
         log_stream.write(f"[json_updater] FATAL ERROR: {e}\n")
@@ -450,15 +759,14 @@ def _run_json_thread() -> None:
 
 
 def _run_hash_thread() -> None:
-    log_stream = SharedLogStream()
+    log_stream = _SHARED_LOG_STREAM
     _reset_log()
 
     updater = ConfigHashUpdater(batch_size=1000)
     _mark_job_start(hash_state, updater)
 
     try:
-        with contextlib.redirect_stdout(log_stream):
-            updater.update_hashes()
+        updater.update_hashes()
         _mark_job_finish(hash_state, {"hash_stats": getattr(updater, "stats", None)})
     except Exception as e:
         log_stream.write(f"[hash_updater] FATAL ERROR: {e}\n")
@@ -466,28 +774,35 @@ def _run_hash_thread() -> None:
 
 
 def _run_group_thread() -> None:
-    log_stream = SharedLogStream()
+    log_stream = _SHARED_LOG_STREAM
     _reset_log()
 
     updater = ConfigGroupUpdater(batch_size=500)
     _mark_job_start(group_state, updater)
 
     try:
-        with contextlib.redirect_stdout(log_stream):
-            updater.update_groups()
+        updater.update_groups()
         _mark_job_finish(group_state, {"group_stats": getattr(updater, "stats", None)})
     except Exception as e:
         log_stream.write(f"[group_updater] FATAL ERROR: {e}\n")
         _mark_job_finish(group_state, {"error": str(e)})
 
 
+# متد ورودی JsonRepairUpdater یک بار در import پیدا می‌شود، نه با hasattr در هر اجرا
+_JR_ENTRY = None
+if JsonRepairUpdater is not None:
+    for _name in ("run", "repair", "repair_invalid_then_convert"):
+        _JR_ENTRY = getattr(JsonRepairUpdater, _name, None)
+        if _JR_ENTRY is not None:
+            break
+
+
 def _run_json_repair_thread() -> None:
-    log_stream = SharedLogStream()
+    log_stream = _SHARED_LOG_STREAM
     _reset_log()
 
     if JsonRepairUpdater is None:
-        with contextlib.redirect_stdout(log_stream):
-            print("[json_repair] JsonRepairUpdater module not available.")
+        print("[json_repair] JsonRepairUpdater module not available.")
         _mark_job_finish(json_repair_state, {"error": "JsonRepairUpdater not available"})
         return
 
@@ -495,15 +810,9 @@ def _run_json_repair_thread() -> None:
     _mark_job_start(json_repair_state, updater)
 
     try:
-        with contextlib.redirect_stdout(log_stream):
-            if hasattr(updater, "run"):
-                updater.run()
-            elif hasattr(updater, "repair"):
-                updater.repair()
-            elif hasattr(updater, "repair_invalid_then_convert"):
-                updater.repair_invalid_then_convert()
-            else:
-                raise RuntimeError("JsonRepairUpdater has no runnable entry method")
+        if _JR_ENTRY is None:
+            raise RuntimeError("JsonRepairUpdater has no runnable entry method")
+        _JR_ENTRY(updater)
         _mark_job_finish(json_repair_state, {"json_repair_stats": getattr(updater, "stats", None)})
     except Exception as e:
         log_stream.write(f"[json_repair] FATAL ERROR: {e}\n")
@@ -511,19 +820,27 @@ def _run_json_repair_thread() -> None:
 
 
 def _run_compress_thread() -> None:
-    log_stream = SharedLogStream()
+    log_stream = _SHARED_LOG_STREAM
     _reset_log()
 
     _mark_job_start(compress_state, instance=True)
 
     try:
-        with contextlib.redirect_stdout(log_stream):
-            db_path = os.path.abspath(get_db_path())
-            db_dir = os.path.dirname(db_path)
-            base = os.path.basename(db_path)
-            ts = time.strftime("%Y%m%d-%H%M%S")
-            out_path = os.path.join(db_dir, f"{base}.{ts}.xz")
-            compress_db_func(db_path, out_path)
+        db_path = os.path.abspath(_cached_db_path())
+        db_dir = os.path.dirname(db_path)
+        base = os.path.basename(db_path)
+        ts = time.strftime("%Y%m%d-%H%M%S")
+        out_path = os.path.join(db_dir, f"{base}.{ts}.xz")
+        # قبل از فشرده‌سازی WAL را در فایل اصلی خالی می‌کنیم تا خروجی کامل و کوچک‌تر باشد
+        try:
+            conn = sqlite3.connect(db_path, timeout=5.0)
+            try:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"[compress] wal_checkpoint failed (ignored): {e}")
+        compress_db_func(db_path, out_path)
         _mark_job_finish(compress_state, {"output": out_path})
     except Exception as e:
         log_stream.write(f"[compress] FATAL ERROR: {e}\n")
@@ -545,26 +862,23 @@ class TestProcess:
             pass
 
 
-_test_arg_cache_lock = threading.Lock()
-_test_arg_cache: Dict[str, bool] = {}
-
+_TEST_ARG_RE = re.compile(r"""add_argument\(\s*["'](--[a-z0-9-]+)""")
 
-def _script_supports_arg(script_path: Path, arg: str) -> bool:
-    key = f"{script_path}:{arg}"
-    with _test_arg_cache_lock:
-        if key in _test_arg_cache:
-            return _test_arg_cache[key]
 
+def _scan_script_args(script_path: Path) -> frozenset:
+    """آرگومان‌های argparse اسکریپت تست را با یک اسکن متنی ساده درمی‌آورد (بدون fork)."""
     try:
-        r = subprocess.run([sys.executable or "python3", str(script_path), "-h"], capture_output=True, text=True, timeout=3)
-        out = (r.stdout or "") + (r.stderr or "")
-        ok = arg in out
+        text = script_path.read_text(encoding="utf-8", errors="replace")
     except Exception:
-        ok = False
+        return frozenset()
+    return frozenset(_TEST_ARG_RE.findall(text))
+
+
+_TEST_SCRIPT_ARGS: frozenset = _scan_script_args(BASE_DIR / "test_batch_10.py")
 
-    with _test_arg_cache_lock:
-        _test_arg_cache[key] = ok
-    return ok
+
+def _script_supports_arg(script_path: Path, arg: str) -> bool:
+    return arg in _TEST_SCRIPT_ARGS
 
 
 class TestRunRequest(BaseModel):
@@ -637,18 +951,31 @@ def _run_test_thread(req: TestRunRequest) -> None:
             cmd,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            universal_newlines=True,
+            bufsize=0,
             env=_subprocess_env_for_test(),
         )
 
         with jobs_lock:
             test_state["instance"] = TestProcess(proc)
 
+        # خواندن باینری chunk به chunk؛ decode فقط روی خط‌های کامل
         assert proc.stdout is not None
-        for line in proc.stdout:
-            _append_test_log_line(line)
+        fd = proc.stdout.fileno()
+        residual = b""
+        while True:
+            try:
+                chunk = os.read(fd, 65536)
+            except OSError:
+                break
+            if not chunk:
+                break
+            residual += chunk
+            parts = residual.split(b"\n")
+            residual = parts[-1]
+            if len(parts) > 1:
+                _append_test_log_lines(raw.decode("utf-8", "replace") for raw in parts[:-1])
+        if residual.strip():
+            _append_test_log_line(residual.decode("utf-8", "replace"))
 
         rc = proc.wait()
         _append_test_log_line(f"[test] finished rc={rc}")
@@ -659,6 +986,10 @@ def _run_test_thread(req: TestRunRequest) -> None:
 
 
 # ----------------- Routes -----------------
+#
+# قاعده: handlerهایی که کار blocking دارند (sqlite، فایل، قفل طولانی) باید `def` ساده
+# باشند تا Starlette آن‌ها را در threadpool اجرا کند؛ `async def` فقط برای مسیرهایی
+# که واقعا await می‌کنند یا صرفا از حافظه می‌خوانند.
 
 
 class SQLQuery(BaseModel):
@@ -670,44 +1001,101 @@ class SettingsPayload(BaseModel):
     settings: Dict[str, Any]
 
 
+# یک بار خواندن در import؛ هر GET / فقط همین bytes را برمی‌گرداند (و با تغییر mtime تازه می‌شود)
+_INDEX_HTML_BYTES: Optional[bytes] = None
+_INDEX_HTML_ETAG: str = ""
+_INDEX_HTML_MTIME_NS: int = -1
+
+
+def _index_payload() -> tuple[Optional[bytes], str]:
+    global _INDEX_HTML_BYTES, _INDEX_HTML_ETAG, _INDEX_HTML_MTIME_NS
+    try:
+        mtime_ns = INDEX_HTML_PATH.stat().st_mtime_ns
+    except OSError:
+        return None, ""
+    if mtime_ns != _INDEX_HTML_MTIME_NS:
+        data = INDEX_HTML_PATH.read_bytes()
+        _INDEX_HTML_BYTES = data
+        _INDEX_HTML_ETAG = 'W/"' + hashlib.blake2b(data, digest_size=16).hexdigest() + '"'
+        _INDEX_HTML_MTIME_NS = mtime_ns
+    return _INDEX_HTML_BYTES, _INDEX_HTML_ETAG
+
+
+try:
+    _index_payload()
+except OSError:
+    pass
+
+
 @app.get("/", response_class=HTMLResponse)
-async def index():
-    if not INDEX_HTML_PATH.exists():
+async def index(request: Request):
+    body, etag = _index_payload()
+    if body is None:
         raise HTTPException(status_code=500, detail="index.html not found")
-    html = INDEX_HTML_PATH.read_text(encoding="utf-8")
+    if etag and request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
     return HTMLResponse(
-        content=html,
-        headers={"Cache-Control": "no-store, no-cache, must-revalidate, max-age=0", "Pragma": "no-cache", "Expires": "0"},
+        content=body,
+        headers={"Cache-Control": "no-cache", "ETag": etag},
     )
 
 
+# نتیجه‌ی exists با TTL یک ثانیه؛ /health مدام poll می‌شود
+_db_exists_cache: tuple = (0.0, False)
+
+
 @app.get("/health")
-async def health():
-    db_path = get_db_path()
-    ok = os.path.exists(db_path)
+def health():
+    global _db_exists_cache
+    db_path = _cached_db_path()
+    now = time.monotonic()
+    ts, ok = _db_exists_cache
+    if now - ts >= 1.0:
+        ok = os.path.exists(db_path)
+        _db_exists_cache = (now, ok)
     return {"status": "ok" if ok else "missing", "db_path": db_path}
 
 
 @app.post("/db/query")
-async def post_query(payload: SQLQuery):
+def post_query(payload: SQLQuery):
     q = payload.query or ""
     if not q.strip():
         raise HTTPException(status_code=400, detail="Empty query.")
     try:
         data = run_query(q, payload.params)
-        return JSONResponse(data)
+        return DefaultJSONResponse(data)
     except sqlite3.Error as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@app.get("/db/pool-health")
+async def db_pool_health():
+    with _pool_lock:
+        ro = _pool_counts["ro"]
+        rw = _pool_counts["rw"]
+        acq = _pool_stats["acquisitions"]
+        wait_total = _pool_stats["wait_total_s"]
+    idle = _read_pool.qsize() + _write_pool.qsize()
+    total = ro + rw
+    return {
+        "active": max(0, total - idle),
+        "idle": idle,
+        "total": total,
+        "max_readers": _READ_POOL_SIZE,
+        "max_writers": 1,
+        "total_acquisitions": acq,
+        "avg_wait_ms": (wait_total / acq * 1000.0) if acq else 0.0,
+    }
+
+
 @app.get("/settings")
-async def get_settings():
+def get_settings():
     st = load_settings()
     return {"path": str(_settings_path()), "settings": st}
 
 
 @app.put("/settings")
-async def put_settings(payload: SettingsPayload = Body(...)):
+def put_settings(payload: SettingsPayload = Body(...)):
     try:
         merged = save_settings(payload.settings)
     except Exception as e:
@@ -715,192 +1103,122 @@ async def put_settings(payload: SettingsPayload = Body(...)):
     return {"status": "saved", "path": str(_settings_path()), "settings": merged}
 
 
-@app.get("/collector/log")
-async def collector_log(offset: int = Query(0, ge=0)):
-    with jobs_lock:
-        total = len(shared_log)
-        if offset < 0 or offset > total:
-            offset = 0
-        lines = shared_log[offset:]
-    return {"offset": offset, "total": total, "lines": lines}
-
-
-@app.get("/jobs/summary")
-async def jobs_summary():
-    with jobs_lock:
-        any_running = any(
-            s["running"]
-            for s in (
-                collector_state,
-                importer_state,
-                json_state,
-                hash_state,
-                group_state,
-                json_repair_state,
-                compress_state,
-                test_state,
-            )
-        )
-    return {
-        "db_path": get_db_path(),
-        "any_running": any_running,
-        "jobs": {
-            "collector": _job_status_payload(collector_state),
-            "importer": _job_status_payload(importer_state),
-            "json": _job_status_payload(json_state),
-            "hash": _job_status_payload(hash_state),
-            "group": _job_status_payload(group_state),
-            "json_repair": _job_status_payload(json_repair_state),
-            "compress": _job_status_payload(compress_state),
-            "test": _job_status_payload(test_state),
-        },
-    }
-
-
-def _start_thread_if_idle(state: Dict[str, Any], target) -> None:
-    with jobs_lock:
-        if state["running"]:
-            raise HTTPException(status_code=409, detail=f"{state['name']} is already running")
-        t = threading.Thread(target=target, daemon=True)
-        t.start()
-
-
-@app.post("/collector/run")
-async def run_collector():
-    _start_thread_if_idle(collector_state, _run_collector_thread)
-    return {"status": "started"}
-
-
-@app.post("/collector/stop")
-async def stop_collector():
+def _log_tail_response(request: Request, log: "collections.deque[str]", offset: int, key: str) -> Response:
+    # offset نسبت به کل خط‌های نوشته‌شده است، نه محتوای فعلی deque؛ با eviction جابه‌جا نمی‌شود
     with jobs_lock:
-        if not collector_state["running"]:
-            raise HTTPException(status_code=409, detail="Collector is not running")
-        inst = collector_state.get("instance")
-    if inst is None or not hasattr(inst, "request_stop"):
-        raise HTTPException(status_code=500, detail="Collector instance stop not available")
-    inst.request_stop()
-    return {"status": "stopping"}
-
-
-@app.get("/collector/status")
-async def collector_status():
-    return _job_status_payload(collector_state)
-
-
-@app.post("/importer/run")
-async def run_importer():
-    _start_thread_if_idle(importer_state, _run_importer_thread)
-    return {"status": "started"}
+        total = _log_totals[key]
+        etag = f'"{total}"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        lines = list(log)
+    dropped = total - len(lines)
+    if offset < dropped or offset > total:
+        offset = dropped
+    start = offset - dropped
+    if start:
+        lines = lines[start:]
+    return DefaultJSONResponse({"offset": offset, "total": total, "lines": lines}, headers={"ETag": etag})
 
 
-@app.post("/importer/stop")
-async def stop_importer():
-    with jobs_lock:
-        if not importer_state["running"]:
-            raise HTTPException(status_code=409, detail="Importer is not running")
-        inst = importer_state.get("instance")
-    if inst is None or not hasattr(inst, "request_stop"):
-        raise HTTPException(status_code=500, detail="Importer instance stop not available")
-    inst.request_stop()
-    return {"status": "stopping"}
-
-
-@app.get("/importer/status")
-async def importer_status():
-    return _job_status_payload(importer_state)
+@app.get("/collector/log")
+def collector_log(request: Request, offset: int = Query(0, ge=0)):
+    return _log_tail_response(request, shared_log, offset, "collector")
 
 
-@app.post("/json/run")
-async def run_json():
-    _start_thread_if_idle(json_state, _run_json_thread)
-    return {"status": "started"}
+@app.websocket("/ws/logs")
+async def ws_logs(ws: WebSocket):
+    """
+    خطوط لاگ collector/test را push می‌کند؛ مسیرهای polling به عنوان fallback سر جایشان هستند.
+    """
+    await ws.accept()
+    q: "queue.Queue" = queue.Queue(maxsize=1000)
+    _log_subscribers.add(q)
+    try:
+        while True:
+            try:
+                source, line = await asyncio.to_thread(q.get, True, 1.0)
+            except queue.Empty:
+                continue
+            await ws.send_json({"source": source, "line": line})
+    except Exception:
+        pass
+    finally:
+        _log_subscribers.discard(q)
 
 
-@app.post("/json/stop")
-async def stop_json():
-    with jobs_lock:
-        if not json_state["running"]:
-            raise HTTPException(status_code=409, detail="JSON updater is not running")
-        inst = json_state.get("instance")
-    if inst is None or not hasattr(inst, "request_stop"):
-        raise HTTPException(status_code=500, detail="JSON updater instance stop not available")
-    inst.request_stop()
-    return {"status": "stopping"}
+@app.get("/jobs/summary")
+async def jobs_summary():
+    snap = _jobs_snapshot
+    return {
+        "db_path": _cached_db_path(),
+        "any_running": snap["any_running"],
+        "jobs": snap["jobs"],
+    }
 
 
-@app.get("/json/status")
-async def json_status():
-    return _job_status_payload(json_state)
+# threadهای job از یک pool ثابت استفاده می‌شوند؛ هر کلیک run یک OS thread جدید نمی‌سازد.
+# به ازای هر نوع job یک worker، تا هیچ submit پشت jobهای طولانی در صف نماند
+_JOB_KINDS = 8  # collector, importer, json, hash, group, json_repair, compress, test
+JOB_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=_JOB_KINDS, thread_name_prefix="xraymgr-job")
 
 
-@app.post("/hash/run")
-async def run_hash():
-    _start_thread_if_idle(hash_state, _run_hash_thread)
-    return {"status": "started"}
+def _run_job_guarded(state: Dict[str, Any], target) -> None:
+    try:
+        target()
+    finally:
+        # حتی اگر target قبل از _mark_job_start خطا بدهد، job قابل run ماندن بماند
+        with jobs_lock:
+            state["submitted"] = False
 
 
-@app.post("/hash/stop")
-async def stop_hash():
+def _start_thread_if_idle(state: Dict[str, Any], target) -> None:
     with jobs_lock:
-        if not hash_state["running"]:
-            raise HTTPException(status_code=409, detail="Hash updater is not running")
-        inst = hash_state.get("instance")
-    if inst is None or not hasattr(inst, "request_stop"):
-        raise HTTPException(status_code=500, detail="Hash updater instance stop not available")
-    inst.request_stop()
-    return {"status": "stopping"}
-
-
-@app.get("/hash/status")
-async def hash_status():
-    return _job_status_payload(hash_state)
-
-
-@app.post("/group/run")
-async def run_group():
-    _start_thread_if_idle(group_state, _run_group_thread)
-    return {"status": "started"}
-
+        # submitted فاصله‌ی بین submit و شروع fn را می‌پوشاند؛ کلیک تکراری run
+        # نمی‌تواند همان job را دوباره در صف بگذارد
+        if state["running"] or state.get("submitted"):
+            raise HTTPException(status_code=409, detail=f"{state['name']} is already running")
+        state["submitted"] = True
+        JOB_EXECUTOR.submit(_run_job_guarded, state, target)
 
-@app.post("/group/stop")
-async def stop_group():
-    with jobs_lock:
-        if not group_state["running"]:
-            raise HTTPException(status_code=409, detail="Group updater is not running")
-        inst = group_state.get("instance")
-    if inst is None or not hasattr(inst, "request_stop"):
-        raise HTTPException(status_code=500, detail="Group updater instance stop not available")
-    inst.request_stop()
-    return {"status": "stopping"}
 
+# شش job یک الگوی run/stop/status یکسان دارند؛ از روی این جدول ثبت می‌شوند
+_JOB_ROUTES = (
+    ("collector", "Collector", collector_state, _run_collector_thread, True),
+    ("importer", "Importer", importer_state, _run_importer_thread, True),
+    ("json", "JSON updater", json_state, _run_json_thread, True),
+    ("hash", "Hash updater", hash_state, _run_hash_thread, True),
+    ("group", "Group updater", group_state, _run_group_thread, True),
+    ("json_repair", "JSON repair", json_repair_state, _run_json_repair_thread, False),
+)
 
-@app.get("/group/status")
-async def group_status():
-    return _job_status_payload(group_state)
 
+def _register_job_routes(name: str, label: str, state: Dict[str, Any], thread_fn, strict_stop: bool) -> None:
+    async def run_job():
+        _start_thread_if_idle(state, thread_fn)
+        return {"status": "started"}
 
-@app.post("/json_repair/run")
-async def run_json_repair():
-    _start_thread_if_idle(json_repair_state, _run_json_repair_thread)
-    return {"status": "started"}
+    async def stop_job():
+        with jobs_lock:
+            if not state["running"]:
+                raise HTTPException(status_code=409, detail=f"{label} is not running")
+            inst = state.get("instance")
+        if inst is None or not hasattr(inst, "request_stop"):
+            if strict_stop:
+                raise HTTPException(status_code=500, detail=f"{label} instance stop not available")
+            return {"status": "no_stop_supported"}
+        inst.request_stop()
+        return {"status": "stopping"}
 
+    async def job_status():
+        return _job_status_payload(state)
 
-@app.post("/json_repair/stop")
-async def stop_json_repair():
-    with jobs_lock:
-        if not json_repair_state["running"]:
-            raise HTTPException(status_code=409, detail="JSON repair is not running")
-        inst = json_repair_state.get("instance")
-    if inst is None or not hasattr(inst, "request_stop"):
-        return {"status": "no_stop_supported"}
-    inst.request_stop()
-    return {"status": "stopping"}
+    app.add_api_route(f"/{name}/run", run_job, methods=["POST"], name=f"run_{name}")
+    app.add_api_route(f"/{name}/stop", stop_job, methods=["POST"], name=f"stop_{name}")
+    app.add_api_route(f"/{name}/status", job_status, methods=["GET"], name=f"{name}_status")
 
 
-@app.get("/json_repair/status")
-async def json_repair_status():
-    return _job_status_payload(json_repair_state)
+for _row in _JOB_ROUTES:
+    _register_job_routes(*_row)
 
 
 @app.post("/compress/run")
@@ -920,13 +1238,8 @@ async def test_status():
 
 
 @app.get("/test/log")
-async def test_log_endpoint(offset: int = Query(0, ge=0)):
-    with jobs_lock:
-        total = len(test_log)
-        if offset < 0 or offset > total:
-            offset = 0
-        lines = test_log[offset:]
-    return {"offset": offset, "total": total, "lines": lines}
+def test_log_endpoint(request: Request, offset: int = Query(0, ge=0)):
+    return _log_tail_response(request, test_log, offset, "test")
 
 
 @app.post("/test/run")
@@ -940,9 +1253,9 @@ async def test_run(req: TestRunRequest = Body(default_factory=TestRunRequest)):
         test_state["stats"] = None
         test_state["instance"] = None
         test_log.clear()
+        _publish_jobs_snapshot_locked()
 
-        t = threading.Thread(target=_run_test_thread, args=(req,), daemon=True)
-        t.start()
+        JOB_EXECUTOR.submit(_run_test_thread, req)
 
     return {"status": "started"}
 
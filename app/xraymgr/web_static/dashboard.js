@@ -178,8 +178,9 @@
     } else {
       for (const row of rows) {
         html += `<tr>`;
-        for (const c of cols) {
-          let v = row[c];
+        for (let i = 0; i < cols.length; i++) {
+          // ردیف‌ها آرایهٔ مقادیر هستند (هم‌ترتیب با columns)
+          let v = row[i];
           if (v === null || v === undefined) v = "";
           html += `<td>${escapeHtml(String(v))}</td>`;
         }
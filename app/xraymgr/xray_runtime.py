@@ -22,15 +22,38 @@ It provides:
 
 from __future__ import annotations
 
+import concurrent.futures
+import hashlib
 import json
+
+try:
+    import fcntl
+except ImportError:  # non-Linux
+    fcntl = None  # type: ignore
 import os
+import re
 import shutil
 import socket
 import subprocess
 import tempfile
 import threading
+import time
 from dataclasses import dataclass
-from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+# orjson اختیاری است؛ برای خروجی‌های بزرگ lsi/lso چند برابر سریع‌تر parse می‌کند
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None  # type: ignore
+
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+
+def _json_dump_bytes(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
 
 
 DEFAULT_XRAY_BIN_CANDIDATES: Tuple[str, ...] = (
@@ -60,39 +83,64 @@ class CmdResult:
         return self.rc == 0
 
 
-def _first_existing_executable(candidates: Sequence[str]) -> Optional[str]:
+# فقط نتیجه‌های موفق کش می‌شوند و قبل از استفاده با یک stat دوباره validate می‌شوند
+# (همان الگوی _resolve_xray_cache در web.py)؛ شکست کش نمی‌شود تا نصب دیرهنگامِ
+# باینری در پروسه‌ی طولانی‌عمر panel دیده شود
+_exec_resolve_cache: Dict[Tuple[Tuple[str, ...], Optional[str]], str] = {}
+
+
+def _first_existing_executable_cached(candidates: Tuple[str, ...], path_env: Optional[str]) -> Optional[str]:
+    key = (candidates, path_env)
+    cached = _exec_resolve_cache.get(key)
+    if cached is not None and os.path.exists(cached) and os.access(cached, os.X_OK):
+        return cached
     for c in candidates:
         # "xray" in PATH
         if os.path.sep not in c:
             resolved = shutil.which(c)
             if resolved:
+                _exec_resolve_cache[key] = resolved
                 return resolved
             continue
 
         if os.path.exists(c) and os.access(c, os.X_OK):
+            _exec_resolve_cache[key] = c
             return c
     return None
 
 
+def _first_existing_executable(candidates: Sequence[str]) -> Optional[str]:
+    # cache با کلید PATH: اگر PATH عوض شود دوباره جستجو می‌شود، وگرنه بدون stat/which
+    return _first_existing_executable_cached(tuple(candidates), os.environ.get("PATH"))
+
+
+# نتیجه‌ی probe موفق برای 60 ثانیه معتبر می‌ماند؛ ساخت applier با api_server=auto را ارزان می‌کند
+_PROBE_CACHE: Dict[Tuple[str, Tuple[str, ...]], Tuple[str, float]] = {}
+_PROBE_CACHE_TTL_SEC = 60.0
+
+
 def _try_parse_json(s: str) -> Optional[Any]:
-    s = (s or "").strip()
+    # strip لازم نیست؛ هر دو parser whitespace اطراف را قبول می‌کنند و ورودی خالی/سفید except می‌شود
     if not s:
         return None
     try:
-        return json.loads(s)
+        return _json_loads(s)
     except Exception:
         return None
 
 
+# یک اسکن C-level روی متن به جای چند جستجوی in + upper/lower
+_RE_NOT_FOUND = re.compile(r"not[\s_]?found", re.IGNORECASE)
+# heuristics: different builds print different phrases
+_RE_EXIST = re.compile(r"exist|already|duplicate", re.IGNORECASE)
+
+
 def _looks_like_not_found(text: str) -> bool:
-    t = (text or "").strip().upper()
-    return "NOT_FOUND" in t or "NOTFOUND" in t or "NOT FOUND" in t
+    return bool(text) and _RE_NOT_FOUND.search(text) is not None
 
 
 def _stderr_has_exist(stderr: str) -> bool:
-    s = (stderr or "").lower()
-    # heuristics: different builds print different phrases
-    return ("exist" in s) or ("already" in s) or ("duplicate" in s)
+    return bool(stderr) and _RE_EXIST.search(stderr) is not None
 
 
 class XrayRuntimeApplier:
@@ -121,6 +169,7 @@ class XrayRuntimeApplier:
         exist_retry: bool = True,
         command_timeout_sec: float = 20.0,
         api_probe_timeout_sec: float = 3.0,
+        list_cache_ttl_sec: float = 0.3,
     ) -> None:
         self.xray_bin = xray_bin or _first_existing_executable(DEFAULT_XRAY_BIN_CANDIDATES) or str(xray_bin or "")
         self.api_server = str(api_server)
@@ -129,6 +178,11 @@ class XrayRuntimeApplier:
         self.api_probe_timeout_sec = float(api_probe_timeout_sec)
 
         self._lock = threading.Lock()
+        # cache کوتاه‌عمر برای lsi/lso؛ با هر دستور mutate کننده خالی می‌شود
+        self.list_cache_ttl_sec = float(list_cache_ttl_sec)
+        self._list_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        # digest آخرین JSON اعمال‌شده per-tag؛ apply دوباره‌ی همان تعریف subprocess نمی‌خورد
+        self._applied_digests: Dict[Tuple[str, str], bytes] = {}
         self._env = dict(os.environ)
         if env:
             self._env.update({str(k): str(v) for k, v in env.items()})
@@ -136,6 +190,10 @@ class XrayRuntimeApplier:
         if self.api_server.strip().lower() == "auto":
             self.api_server = self.probe_api_server()
 
+        # argv ثابت در طول عمر applier؛ یک بار ساخته می‌شود تا مسیر پرتکرار
+        # _run_xray_api هر بار f-string و str() اضافه نزند
+        self._server_flag = f"--server={self.api_server}"
+
     # -----------------------------
     # Public: probes / listing
     # -----------------------------
@@ -151,13 +209,33 @@ class XrayRuntimeApplier:
         if not os.path.exists(self.xray_bin) and os.path.sep in self.xray_bin:
             return str(candidates[0])
 
-        for srv in candidates:
-            r = self._run_xray_api("lso", server=srv, timeout_sec=self.api_probe_timeout_sec)
-            if r.ok and _try_parse_json(r.stdout) is not None:
-                return str(srv)
+        cache_key = (self.xray_bin, tuple(str(c) for c in candidates))
+        cached = _PROBE_CACHE.get(cache_key)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+
+        # همه‌ی کاندیداها موازی probe می‌شوند؛ بدترین حالت max(timeout) است نه جمع timeoutها
+        ex = concurrent.futures.ThreadPoolExecutor(max_workers=len(candidates))
+        try:
+            futs = {ex.submit(self._probe_one, str(srv)): str(srv) for srv in candidates}
+            for fut in concurrent.futures.as_completed(futs):
+                try:
+                    ok = fut.result()
+                except Exception:
+                    ok = False
+                if ok:
+                    srv = futs[fut]
+                    _PROBE_CACHE[cache_key] = (srv, time.monotonic() + _PROBE_CACHE_TTL_SEC)
+                    return srv
+        finally:
+            ex.shutdown(wait=False, cancel_futures=True)
 
         return str(candidates[0])
 
+    def _probe_one(self, server: str) -> bool:
+        r = self._run_xray_api("lso", server=server, timeout_sec=self.api_probe_timeout_sec)
+        return r.ok and _try_parse_json(r.stdout) is not None
+
     def list_outbounds(self) -> Dict[str, Any]:
         with self._lock:
             return self._list_outbounds_locked()
@@ -198,9 +276,7 @@ class XrayRuntimeApplier:
 
     def remove_outbound(self, tag: str, *, ignore_not_found: bool = True) -> Dict[str, Any]:
         with self._lock:
-            r = self._run_xray_api("rmo", args=[str(tag)])
-            ok = r.ok or (ignore_not_found and (_looks_like_not_found(r.stdout) or _looks_like_not_found(r.stderr)))
-            return {"ok": ok, "tag": str(tag), "action": "rmo", "rc": r.rc, "stdout": r.stdout, "stderr": r.stderr}
+            return self._remove_one_nolock("rmo", tag, ignore_not_found=ignore_not_found)
 
     def add_inbound(self, inbound: Dict[str, Any]) -> Dict[str, Any]:
         with self._lock:
@@ -208,29 +284,26 @@ class XrayRuntimeApplier:
 
     def remove_inbound(self, tag: str, *, ignore_not_found: bool = True) -> Dict[str, Any]:
         with self._lock:
-            r = self._run_xray_api("rmi", args=[str(tag)])
-            ok = r.ok or (ignore_not_found and (_looks_like_not_found(r.stdout) or _looks_like_not_found(r.stderr)))
-            return {"ok": ok, "tag": str(tag), "action": "rmi", "rc": r.rc, "stdout": r.stdout, "stderr": r.stderr}
+            return self._remove_one_nolock("rmi", tag, ignore_not_found=ignore_not_found)
+
+    def remove_inbounds(self, tags: Iterable[str], *, ignore_not_found: bool = True) -> Dict[str, Any]:
+        """
+        Remove several inbounds (rmi) under one lock acquisition.
+        """
+        return self._remove_many("rmi", tags, ignore_not_found=ignore_not_found)
+
+    def remove_outbounds(self, tags: Iterable[str], *, ignore_not_found: bool = True) -> Dict[str, Any]:
+        """
+        Remove several outbounds (rmo) under one lock acquisition.
+        """
+        return self._remove_many("rmo", tags, ignore_not_found=ignore_not_found)
 
     def remove_rules(self, rule_tags: Iterable[str], *, ignore_not_found: bool = True) -> Dict[str, Any]:
         """
         Remove routing rules by ruleTag (rmrules).
         """
-        tags = [str(t) for t in rule_tags if str(t).strip()]
-        if not tags:
-            return {"ok": True, "action": "rmrules", "removed": [], "errors": []}
-
         with self._lock:
-            removed: List[str] = []
-            errors: List[Dict[str, Any]] = []
-            for t in tags:
-                r = self._run_xray_api("rmrules", args=[t])
-                ok = r.ok or (ignore_not_found and (_looks_like_not_found(r.stdout) or _looks_like_not_found(r.stderr)))
-                if ok:
-                    removed.append(t)
-                else:
-                    errors.append({"tag": t, "rc": r.rc, "stdout": r.stdout, "stderr": r.stderr})
-            return {"ok": len(errors) == 0, "action": "rmrules", "removed": removed, "errors": errors}
+            return self._remove_many_nolock("rmrules", rule_tags, ignore_not_found=ignore_not_found)
 
     def apply_rules(self, routing_obj: Dict[str, Any], *, append: bool = False) -> Dict[str, Any]:
         """
@@ -241,10 +314,46 @@ class XrayRuntimeApplier:
           - If append=True, rules are appended.
         """
         with self._lock:
-            payload = self._normalize_routing_payload(routing_obj)
-            args = ["-append"] if append else []
-            r = self._run_with_temp_json("adrules", payload, extra_args=args)
-            return {"ok": r.ok, "action": "adrules", "append": bool(append), "rc": r.rc, "stdout": r.stdout, "stderr": r.stderr}
+            return self._apply_rules_nolock(routing_obj, append=append)
+
+    def _apply_rules_nolock(self, routing_obj: Dict[str, Any], *, append: bool) -> Dict[str, Any]:
+        payload = self._normalize_routing_payload(routing_obj)
+        args = ["-append"] if append else []
+        r = self._run_with_temp_json("adrules", payload, extra_args=args)
+        return {"ok": r.ok, "action": "adrules", "append": bool(append), "rc": r.rc, "stdout": r.stdout, "stderr": r.stderr}
+
+    def _remove_one_nolock(self, subcommand: str, tag: str, *, ignore_not_found: bool = True) -> Dict[str, Any]:
+        # حذف tag یعنی digest اعمال‌شده‌اش دیگر معتبر نیست
+        add_action = {"rmo": "ado", "rmi": "adi"}.get(subcommand)
+        if add_action:
+            self._applied_digests.pop((add_action, str(tag)), None)
+        r = self._run_xray_api(subcommand, args=[str(tag)])
+        ok = r.ok or (ignore_not_found and (_looks_like_not_found(r.stdout) or _looks_like_not_found(r.stderr)))
+        return {"ok": ok, "tag": str(tag), "action": subcommand, "rc": r.rc, "stdout": r.stdout, "stderr": r.stderr}
+
+    def _remove_many(self, subcommand: str, tags: Iterable[str], *, ignore_not_found: bool) -> Dict[str, Any]:
+        with self._lock:
+            return self._remove_many_nolock(subcommand, tags, ignore_not_found=ignore_not_found)
+
+    def _remove_many_nolock(self, subcommand: str, tags: Iterable[str], *, ignore_not_found: bool) -> Dict[str, Any]:
+        clean = [str(t) for t in tags if str(t).strip()]
+        if not clean:
+            return {"ok": True, "action": subcommand, "removed": [], "errors": []}
+
+        removed: List[str] = []
+        errors: List[Dict[str, Any]] = []
+        # مانند _remove_one_nolock: حذف tag یعنی digest اعمال‌شده‌اش دیگر معتبر نیست
+        add_action = {"rmo": "ado", "rmi": "adi"}.get(subcommand)
+        for t in clean:
+            if add_action:
+                self._applied_digests.pop((add_action, t), None)
+            r = self._run_xray_api(subcommand, args=[t])
+            ok = r.ok or (ignore_not_found and (_looks_like_not_found(r.stdout) or _looks_like_not_found(r.stderr)))
+            if ok:
+                removed.append(t)
+            else:
+                errors.append({"tag": t, "rc": r.rc, "stdout": r.stdout, "stderr": r.stderr})
+        return {"ok": len(errors) == 0, "action": subcommand, "removed": removed, "errors": errors}
 
     # -----------------------------
     # Public: apply snapshot
@@ -289,20 +398,46 @@ class XrayRuntimeApplier:
         return None
 
     def _list_outbounds_locked(self) -> Dict[str, Any]:
-        e = self._require_ready()
-        if e:
-            return e
-        r = self._run_xray_api("lso")
-        data = _try_parse_json(r.stdout)
-        return {"ok": r.ok and data is not None, "action": "lso", "rc": r.rc, "stdout": r.stdout, "stderr": r.stderr, "data": data}
+        return self._list_locked("lso")
 
     def _list_inbounds_locked(self) -> Dict[str, Any]:
+        return self._list_locked("lsi")
+
+    def _list_locked(self, subcommand: str) -> Dict[str, Any]:
         e = self._require_ready()
         if e:
             return e
-        r = self._run_xray_api("lsi")
+
+        cached = self._list_cache.get(subcommand)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        r = self._run_xray_api(subcommand)
         data = _try_parse_json(r.stdout)
-        return {"ok": r.ok and data is not None, "action": "lsi", "rc": r.rc, "stdout": r.stdout, "stderr": r.stderr, "data": data}
+        result = {"ok": r.ok and data is not None, "action": subcommand, "rc": r.rc, "stdout": r.stdout, "stderr": r.stderr, "data": data}
+        if result["ok"] and self.list_cache_ttl_sec > 0:
+            self._list_cache[subcommand] = (time.monotonic() + self.list_cache_ttl_sec, result)
+        return result
+
+    def _runtime_tags(self, subcommand: str) -> Optional[Set[str]]:
+        """
+        مجموعه‌ی tagهای زنده‌ی runtime از lso/lsi؛ None یعنی خروجی قابل اتکا نبود.
+        """
+        res = self._list_locked(subcommand)
+        if not res.get("ok"):
+            return None
+        data = res.get("data")
+        if isinstance(data, dict):
+            data = data.get("outbounds" if subcommand == "lso" else "inbounds", data.get("items"))
+        if not isinstance(data, list):
+            return None
+        tags: Set[str] = set()
+        for it in data:
+            if isinstance(it, dict):
+                t = it.get("tag")
+                if t:
+                    tags.add(str(t))
+        return tags
 
     def _apply_snapshot_locked(self, snapshot: Dict[str, Any]) -> Dict[str, Any]:
         e = self._require_ready()
@@ -325,55 +460,104 @@ class XrayRuntimeApplier:
             return self._err("INVALID_SNAPSHOT", "inbounds/outbounds must be lists")
 
         # validate tags presence (بدون تغییر tag)
-        for i, ob in enumerate(outbounds):
-            if not isinstance(ob, dict):
-                return self._err("INVALID_SNAPSHOT", f"outbounds[{i}] must be dict")
-            if not ob.get("tag"):
-                return self._err("INVALID_SNAPSHOT", f"outbounds[{i}] missing 'tag'")
-
-        for i, ib in enumerate(inbounds):
-            if not isinstance(ib, dict):
-                return self._err("INVALID_SNAPSHOT", f"inbounds[{i}] must be dict")
-            if not ib.get("tag"):
-                return self._err("INVALID_SNAPSHOT", f"inbounds[{i}] missing 'tag'")
+        e = self._validate_tagged_items("outbounds", outbounds)
+        if e:
+            return e
+        e = self._validate_tagged_items("inbounds", inbounds)
+        if e:
+            return e
 
         results_out: List[Dict[str, Any]] = []
         results_in: List[Dict[str, Any]] = []
 
         # 1) add/replace outbounds
-        for ob in outbounds:
-            r = self._try_add_outbound(ob)
-            results_out.append(r)
-            if not r.get("ok"):
-                return {
-                    "ok": False,
-                    "error_code": "APPLY_OUTBOUNDS_FAILED",
-                    "error_message": "failed applying outbounds; see item results",
-                    "outbounds": results_out,
-                    "inbounds": results_in,
-                    "routing": None,
-                    "removals": None,
-                }
-
-        # 2) add/replace inbounds
-        for ib in inbounds:
-            r = self._try_add_inbound(ib)
-            results_in.append(r)
-            if not r.get("ok"):
-                return {
-                    "ok": False,
-                    "error_code": "APPLY_INBOUNDS_FAILED",
-                    "error_message": "failed applying inbounds; see item results",
-                    "outbounds": results_out,
-                    "inbounds": results_in,
-                    "routing": None,
-                    "removals": None,
-                }
+        # آیتم‌هایی که digest شان عوض نشده اصلا فرستاده نمی‌شوند؛
+        # بقیه اول همه با یک ado؛ فقط اگر bulk شکست خورد (مثلا exist) به مسیر per-tag برمی‌گردیم
+        if outbounds:
+            pending: List[Dict[str, Any]] = []
+            pending_digests: List[bytes] = []
+            live_out: Optional[Set[str]] = None
+            live_out_checked = False
+            for ob in outbounds:
+                tag = str(ob.get("tag") or "")
+                d = self._digest_of(ob)
+                if self._applied_digests.get(("ado", tag)) == d:
+                    # skip فقط وقتی tag واقعاً در runtime حاضر است؛ lso یک بار
+                    # (و فقط در صورت نیاز) گرفته می‌شود
+                    if not live_out_checked:
+                        live_out = self._runtime_tags("lso")
+                        live_out_checked = True
+                    if live_out is not None and tag in live_out:
+                        results_out.append(self._cached_add_result("ado", tag))
+                        continue
+                    self._applied_digests.pop(("ado", tag), None)
+                pending.append(ob)
+                pending_digests.append(d)
+            if pending:
+                rb = self._run_with_temp_json("ado", {"outbounds": pending})
+                if rb.ok:
+                    results_out.extend(self._bulk_add_results("ado", pending, rb))
+                    for ob, d in zip(pending, pending_digests):
+                        self._applied_digests[("ado", str(ob.get("tag") or ""))] = d
+                else:
+                    for ob in pending:
+                        r = self._try_add_outbound(ob)
+                        results_out.append(r)
+                        if not r.get("ok"):
+                            return {
+                                "ok": False,
+                                "error_code": "APPLY_OUTBOUNDS_FAILED",
+                                "error_message": "failed applying outbounds; see item results",
+                                "outbounds": results_out,
+                                "inbounds": results_in,
+                                "routing": None,
+                                "removals": None,
+                            }
+
+        # 2) add/replace inbounds (همان الگوی digest + bulk-first)
+        if inbounds:
+            pending = []
+            pending_digests = []
+            live_in: Optional[Set[str]] = None
+            live_in_checked = False
+            for ib in inbounds:
+                tag = str(ib.get("tag") or "")
+                d = self._digest_of(ib)
+                if self._applied_digests.get(("adi", tag)) == d:
+                    if not live_in_checked:
+                        live_in = self._runtime_tags("lsi")
+                        live_in_checked = True
+                    if live_in is not None and tag in live_in:
+                        results_in.append(self._cached_add_result("adi", tag))
+                        continue
+                    self._applied_digests.pop(("adi", tag), None)
+                pending.append(ib)
+                pending_digests.append(d)
+            if pending:
+                rb = self._run_with_temp_json("adi", {"inbounds": pending})
+                if rb.ok:
+                    results_in.extend(self._bulk_add_results("adi", pending, rb))
+                    for ib, d in zip(pending, pending_digests):
+                        self._applied_digests[("adi", str(ib.get("tag") or ""))] = d
+                else:
+                    for ib in pending:
+                        r = self._try_add_inbound(ib)
+                        results_in.append(r)
+                        if not r.get("ok"):
+                            return {
+                                "ok": False,
+                                "error_code": "APPLY_INBOUNDS_FAILED",
+                                "error_message": "failed applying inbounds; see item results",
+                                "outbounds": results_out,
+                                "inbounds": results_in,
+                                "routing": None,
+                                "removals": None,
+                            }
 
         # 3) remove old rules (optional cleanup), then apply routing (optional)
         routing_result: Optional[Dict[str, Any]] = None
         if remove_rule_tags:
-            rr = self.remove_rules(remove_rule_tags, ignore_not_found=True)
+            rr = self._remove_many_nolock("rmrules", remove_rule_tags, ignore_not_found=True)
             if not rr.get("ok"):
                 return {
                     "ok": False,
@@ -396,7 +580,7 @@ class XrayRuntimeApplier:
                     "routing": None,
                     "removals": None,
                 }
-            routing_result = self.apply_rules(routing, append=routing_append)
+            routing_result = self._apply_rules_nolock(routing, append=routing_append)
             if not routing_result.get("ok"):
                 return {
                     "ok": False,
@@ -408,12 +592,18 @@ class XrayRuntimeApplier:
                     "removals": None,
                 }
 
-        # 4) removals AFTER routing (cutover-safe)
+        # 4) removals AFTER routing (cutover-safe) — مستقل از هم، پس موازی اجرا می‌شوند
         removals: Dict[str, Any] = {"outbounds": [], "inbounds": []}
-        for t in remove_outbound_tags:
-            removals["outbounds"].append(self.remove_outbound(str(t), ignore_not_found=True))
-        for t in remove_inbound_tags:
-            removals["inbounds"].append(self.remove_inbound(str(t), ignore_not_found=True))
+        tasks: List[Tuple[str, str, str]] = [("outbounds", "rmo", str(t)) for t in remove_outbound_tags]
+        tasks.extend(("inbounds", "rmi", str(t)) for t in remove_inbound_tags)
+        if len(tasks) == 1:
+            kind, sub, tag = tasks[0]
+            removals[kind].append(self._remove_one_nolock(sub, tag, ignore_not_found=True))
+        elif tasks:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, len(tasks))) as ex:
+                futs = [ex.submit(self._remove_one_nolock, sub, tag, ignore_not_found=True) for _, sub, tag in tasks]
+                for (kind, _, _), fut in zip(tasks, futs):
+                    removals[kind].append(fut.result())
 
         return {
             "ok": True,
@@ -425,6 +615,32 @@ class XrayRuntimeApplier:
             "removals": removals if (remove_outbound_tags or remove_inbound_tags) else None,
         }
 
+    def _validate_tagged_items(self, kind: str, items: List[Any]) -> Optional[Dict[str, Any]]:
+        """
+        یک گذر سریع روی همه‌ی آیتم‌ها؛ فقط در صورت خطا مسیر کند per-index برای پیام دقیق.
+        """
+        try:
+            tags = [it["tag"] for it in items]
+        except (TypeError, KeyError):
+            for i, it in enumerate(items):
+                if not isinstance(it, dict):
+                    return self._err("INVALID_SNAPSHOT", f"{kind}[{i}] must be dict")
+                if not it.get("tag"):
+                    return self._err("INVALID_SNAPSHOT", f"{kind}[{i}] missing 'tag'")
+            return self._err("INVALID_SNAPSHOT", f"{kind} invalid")
+
+        if not all(tags):
+            for i, t in enumerate(tags):
+                if not t:
+                    return self._err("INVALID_SNAPSHOT", f"{kind}[{i}] missing 'tag'")
+
+        try:
+            if len(set(tags)) != len(tags):
+                return self._err("INVALID_SNAPSHOT", f"{kind} contain duplicate tags")
+        except TypeError:
+            pass
+        return None
+
     def _run_xray_api(
         self,
         subcommand: str,
@@ -433,39 +649,80 @@ class XrayRuntimeApplier:
         args: Optional[Sequence[str]] = None,
         timeout_sec: Optional[float] = None,
     ) -> CmdResult:
-        srv = str(server or self.api_server)
-        cmd: List[str] = [self.xray_bin, "api", str(subcommand), f"--server={srv}"]
+        if subcommand in ("adi", "ado", "rmi", "rmo", "adrules", "rmrules"):
+            # هر mutate کننده‌ی runtime، نتایج lsi/lso کش‌شده را بی‌اعتبار می‌کند
+            self._list_cache.clear()
+        server_flag = f"--server={server}" if server else self._server_flag
+        cmd: List[str] = [self.xray_bin, "api", subcommand, server_flag]
         if args:
             cmd.extend([str(a) for a in args])
 
         try:
-            p = subprocess.run(
+            # close_fds=False اجازه می‌دهد CPython از posix_spawn استفاده کند (بدون کپی page-table در fork)؛
+            # از PEP 446 به بعد fdها به صورت پیش‌فرض non-inheritable هستند پس چیزی به xray نشت نمی‌کند.
+            # preexec_fn/pass_fds نباید اضافه شوند وگرنه این مسیر سریع از بین می‌رود.
+            p = subprocess.Popen(
                 cmd,
-                capture_output=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
                 text=True,
                 encoding="utf-8",
                 errors="replace",
                 env=self._env,
-                timeout=float(timeout_sec if timeout_sec is not None else self.command_timeout_sec),
+                close_fds=False,
             )
-            return CmdResult(p.returncode, (p.stdout or "").strip(), (p.stderr or "").strip())
-        except subprocess.TimeoutExpired as e:
-            out = ""
-            err = f"timeout running command: {cmd!r}"
-            if getattr(e, "stdout", None):
-                out = str(e.stdout)
-            if getattr(e, "stderr", None):
-                err = str(e.stderr)
-            return CmdResult(124, (out or "").strip(), (err or "").strip())
+            if fcntl is not None and p.stdout is not None:
+                # pipe بزرگ‌تر: خروجی lsi با صدها tag بدون block شدن child و چند read کوتاه عبور می‌کند
+                try:
+                    fcntl.fcntl(p.stdout.fileno(), getattr(fcntl, "F_SETPIPE_SZ", 1031), 1 << 20)
+                except OSError:
+                    pass
+            try:
+                out, err = p.communicate(timeout=float(timeout_sec if timeout_sec is not None else self.command_timeout_sec))
+            except subprocess.TimeoutExpired:
+                p.kill()
+                out, err = p.communicate()
+                return CmdResult(124, out or "", err or f"timeout running command: {cmd!r}")
+            if p.returncode != 0 and "connection refused" in (err or "").lower():
+                # سرور API از دسترس خارج شده؛ probe و digestهای اعمال‌شده دیگر قابل اتکا نیستند
+                _PROBE_CACHE.clear()
+                self._applied_digests.clear()
+            # strip نمی‌کنیم: برای خروجی‌های چند‌کیلوبایتی lsi یک کپی کامل اضافه است؛
+            # parser و regexها خودشان whitespace را تحمل می‌کنند
+            return CmdResult(p.returncode, out or "", err or "")
         except Exception as e:
             return CmdResult(1, "", f"failed running command: {e}")
 
     def _run_with_temp_json(self, subcommand: str, obj: Dict[str, Any], *, extra_args: Optional[Sequence[str]] = None) -> CmdResult:
+        # ترجیح با memfd: فایل ناشناس در حافظه، بدون create/unlink روی فایل‌سیستم.
+        # fd ارث می‌رسد (close_fds=False در _run_xray_api) و child آن را از /proc/self/fd باز می‌کند.
+        fd: Optional[int] = None
+        if hasattr(os, "memfd_create"):
+            try:
+                fd = os.memfd_create("xray-cfg", os.MFD_CLOEXEC)
+            except OSError:
+                fd = None
+        if fd is not None:
+            try:
+                os.write(fd, _json_dump_bytes(obj))
+                os.set_inheritable(fd, True)
+                args = list(extra_args or [])
+                args.append(f"/proc/self/fd/{fd}")
+                return self._run_xray_api(subcommand, args=args)
+            finally:
+                try:
+                    os.close(fd)
+                except Exception:
+                    pass
+
         path = None
         try:
-            with tempfile.NamedTemporaryFile(mode="w", suffix=".json", delete=False, encoding="utf-8") as f:
-                json.dump(obj, f, ensure_ascii=False)
-                path = f.name
+            # bytes آماده با یک write؛ نه json.dump کاراکتر به کاراکتر از TextIOWrapper
+            tfd, path = tempfile.mkstemp(suffix=".json")
+            try:
+                os.write(tfd, _json_dump_bytes(obj))
+            finally:
+                os.close(tfd)
             args = list(extra_args or [])
             args.append(path)
             return self._run_xray_api(subcommand, args=args)
@@ -476,8 +733,60 @@ class XrayRuntimeApplier:
                 except Exception:
                     pass
 
+    @staticmethod
+    def _digest_of(obj: Dict[str, Any]) -> bytes:
+        if orjson is not None:
+            return hashlib.sha256(orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)).digest()
+        return hashlib.sha256(json.dumps(obj, sort_keys=True, ensure_ascii=False).encode("utf-8")).digest()
+
+    @staticmethod
+    def _cached_add_result(action: str, tag: str) -> Dict[str, Any]:
+        return {
+            "ok": True,
+            "tag": tag,
+            "action": action,
+            "attempts": 0,
+            "cached": True,
+            "rc": 0,
+            "stdout": "",
+            "stderr": "",
+            "removed_existing": False,
+            "remove_rc": None,
+            "remove_stdout": None,
+            "remove_stderr": None,
+        }
+
+    def _bulk_add_results(self, action: str, items: List[Dict[str, Any]], r: CmdResult) -> List[Dict[str, Any]]:
+        """
+        نتیجه‌ی یک فراخوان bulk موفق را به همان قرارداد per-item قبلی پخش می‌کند.
+        """
+        return [
+            {
+                "ok": True,
+                "tag": str(it.get("tag") or ""),
+                "action": action,
+                "attempts": 1,
+                "rc": r.rc,
+                "stdout": r.stdout,
+                "stderr": r.stderr,
+                "removed_existing": False,
+                "remove_rc": None,
+                "remove_stdout": None,
+                "remove_stderr": None,
+            }
+            for it in items
+        ]
+
     def _try_add_outbound(self, outbound: Dict[str, Any]) -> Dict[str, Any]:
         tag = str(outbound.get("tag") or "")
+        digest = self._digest_of(outbound)
+        if self._applied_digests.get(("ado", tag)) == digest:
+            # digest برابر کافی نیست؛ tag ممکن است از مسیر دیگری حذف شده باشد.
+            # فقط اگر واقعاً در runtime حاضر است skip کن
+            live = self._runtime_tags("lso")
+            if live is not None and tag in live:
+                return self._cached_add_result("ado", tag)
+            self._applied_digests.pop(("ado", tag), None)
         payload = {"outbounds": [outbound]}
         r1 = self._run_with_temp_json("ado", payload)
 
@@ -489,6 +798,8 @@ class XrayRuntimeApplier:
             rm_result = rm
             removed_existing = rm.ok
             r2 = self._run_with_temp_json("ado", payload)
+            if r2.ok:
+                self._applied_digests[("ado", tag)] = digest
             return {
                 "ok": r2.ok,
                 "tag": tag,
@@ -503,6 +814,8 @@ class XrayRuntimeApplier:
                 "remove_stderr": rm_result.stderr if rm_result else None,
             }
 
+        if r1.ok:
+            self._applied_digests[("ado", tag)] = digest
         return {
             "ok": r1.ok,
             "tag": tag,
@@ -519,6 +832,13 @@ class XrayRuntimeApplier:
 
     def _try_add_inbound(self, inbound: Dict[str, Any]) -> Dict[str, Any]:
         tag = str(inbound.get("tag") or "")
+        digest = self._digest_of(inbound)
+        if self._applied_digests.get(("adi", tag)) == digest:
+            # مانند outbound: قبل از skip، حضور واقعی tag در runtime را چک کن
+            live = self._runtime_tags("lsi")
+            if live is not None and tag in live:
+                return self._cached_add_result("adi", tag)
+            self._applied_digests.pop(("adi", tag), None)
         payload = {"inbounds": [inbound]}
         r1 = self._run_with_temp_json("adi", payload)
 
@@ -530,6 +850,8 @@ class XrayRuntimeApplier:
             rm_result = rm
             removed_existing = rm.ok
             r2 = self._run_with_temp_json("adi", payload)
+            if r2.ok:
+                self._applied_digests[("adi", tag)] = digest
             return {
                 "ok": r2.ok,
                 "tag": tag,
@@ -544,6 +866,8 @@ class XrayRuntimeApplier:
                 "remove_stderr": rm_result.stderr if rm_result else None,
             }
 
+        if r1.ok:
+            self._applied_digests[("adi", tag)] = digest
         return {
             "ok": r1.ok,
             "tag": tag,
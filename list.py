@@ -3,6 +3,12 @@
 
 from __future__ import annotations
 
+import heapq
+import json
+import os
+import re
+import stat
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Iterable
 
@@ -13,6 +19,10 @@ BRANCH = "main"
 TREE_BASE = f"https://github.com/{OWNER}/{REPO}/tree/{BRANCH}"
 RAW_BASE = f"https://raw.githubusercontent.com/{OWNER}/{REPO}/refs/heads/{BRANCH}"
 
+# prefix هر خط خروجی یک بار encode می‌شود؛ ساخت خط فقط یک الحاق bytes است
+_D_LINE_PREFIX = f"d {TREE_BASE}/".encode("utf-8")
+_F_LINE_PREFIX = f"f {RAW_BASE}/".encode("utf-8")
+
 # فقط همین ریشه‌ها را لیست می‌کنیم (مطابق خروجی‌ای که قبلاً دادی)
 INCLUDE_ROOTS = [
     "app",
@@ -33,62 +43,148 @@ EXCLUDE_DIR_PREFIXES = [
 EXCLUDE_DIR_NAMES = {".git", "__pycache__"}
 EXCLUDE_FILE_NAMES = {"filelist.txt"}  # خودِ خروجی را داخل لیست نیاور
 
+# یک بار کامپایل می‌شوند تا هر مسیر فقط یک اسکن C-level بخورد
+# (به جای startswith روی تک‌تک prefixها و split+any روی سگمنت‌ها)
+_EXCL_RE = re.compile("^(?:" + "|".join(re.escape(p) for p in EXCLUDE_DIR_PREFIXES) + ")")
+_EXCL_NAME_RE = re.compile(r"(?:^|/)(?:" + "|".join(map(re.escape, EXCLUDE_DIR_NAMES)) + r")(?:$|/)")
 
-def _to_posix(rel: Path) -> str:
-    return rel.as_posix().lstrip("./")
+REPO_ROOT = str(Path(__file__).resolve().parent)
 
+# کش لیست دایرکتوری‌ها بین اجراها: کلید مسیر مطلق، مقدار [mtime_ns, dirnames, filenames].
+# mtime دایرکتوری با هر add/remove/rename داخلش عوض می‌شود؛ روی درخت بدون تغییر،
+# اجرای بعدی به جای readdir فقط یک stat per-dir می‌خورد
+_CACHE_PATH = os.path.join(REPO_ROOT, ".filelist_cache.json")
+_DIR_CACHE: dict[str, list] = {}
+_DIR_CACHE_NEW: dict[str, list] = {}
+
+# هر prefix دقیقاً یک زیرشاخه است؛ نسخه‌ی مطلقش اجازه می‌دهد هرس داخل خودِ
+# scandir با یک membership روی entry.path انجام شود، بدون ساخت مسیر نسبی
+_EXCL_ABS = frozenset(os.path.join(REPO_ROOT, p.rstrip("/")) for p in EXCLUDE_DIR_PREFIXES)
 
-def _is_excluded_dir(rel_posix: str) -> bool:
-    if any(rel_posix.startswith(p) for p in EXCLUDE_DIR_PREFIXES):
-        return True
-    # هر سگمنت اگر یکی از نام‌های نویز بود
-    parts = rel_posix.split("/")
-    return any(p in EXCLUDE_DIR_NAMES for p in parts if p)
 
+def _writev_all(fd: int, bufs: list[bytes]) -> None:
+    if not hasattr(os, "writev"):  # خارج از POSIX
+        os.write(fd, b"".join(bufs))
+        bufs.clear()
+        return
+    # writev ممکن است partial بنویسد؛ تا تخلیه‌ی کامل ادامه بده
+    while bufs:
+        written = os.writev(fd, bufs)
+        while bufs and written >= len(bufs[0]):
+            written -= len(bufs.pop(0))
+        if bufs and written:
+            bufs[0] = bufs[0][written:]
 
-def _walk_dirs_and_files(root: Path) -> tuple[list[str], list[str]]:
+
+def _is_excluded_dir(rel_posix: str) -> bool:
+    return bool(_EXCL_RE.match(rel_posix) or _EXCL_NAME_RE.search(rel_posix))
+
+
+def _list_dir_cached(path: str) -> tuple[list[str], list[str]] | None:
+    """لیست (dirnames, filenames) یک دایرکتوری؛ روی hit کش فقط یک stat می‌خورد."""
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _DIR_CACHE.get(path)
+    if cached is not None and cached[0] == mtime_ns:
+        _DIR_CACHE_NEW[path] = cached
+        return cached[1], cached[2]
+    dirnames: list[str] = []
+    filenames: list[str] = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    dirnames.append(entry.name)
+                elif entry.is_file(follow_symlinks=False):
+                    filenames.append(entry.name)
+    except OSError:
+        return None
+    _DIR_CACHE_NEW[path] = [mtime_ns, dirnames, filenames]
+    return dirnames, filenames
+
+
+def _load_dir_cache() -> None:
+    try:
+        with open(_CACHE_PATH, "r", encoding="utf-8") as fh:
+            data = json.load(fh)
+        if isinstance(data, dict):
+            _DIR_CACHE.update(data)
+    except (OSError, ValueError):
+        pass
+
+
+def _save_dir_cache() -> None:
+    # فقط دایرکتوری‌های دیده‌شده در همین اجرا ذخیره می‌شوند؛ مسیرهای حذف‌شده
+    # خودبه‌خود از کش می‌افتند. نوشتن atomic است که اجرای نیمه‌کاره کش را خراب نکند
+    tmp = _CACHE_PATH + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(_DIR_CACHE_NEW, fh)
+        os.replace(tmp, _CACHE_PATH)
+    except OSError:
+        pass
+
+
+def _walk_dirs_and_files(root: Path, is_dir: bool = True) -> tuple[list[str], list[str]]:
     """
     برمی‌گرداند:
       - dirs: لیست مسیرهای دایرکتوری (نسبت به repo root) به شکل posix
       - files: لیست مسیرهای فایل (نسبت به repo root) به شکل posix
+
+    از os.scandir با پشته‌ی صریح استفاده می‌کنیم: DirEntry نوع entry را از
+    getdents64 کش می‌کند و برخلاف rglob برای هر مسیر دو بار stat نمی‌زند.
     """
     dirs: list[str] = []
     files: list[str] = []
 
-    repo_root = Path(__file__).resolve().parent
+    repo_root = REPO_ROOT
 
-    if root.is_file():
-        rel = root.relative_to(repo_root)
-        rel_posix = _to_posix(rel)
-        if Path(rel_posix).name not in EXCLUDE_FILE_NAMES:
+    if not is_dir:
+        rel_posix = os.path.relpath(str(root), repo_root).replace(os.sep, "/")
+        if os.path.basename(rel_posix) not in EXCLUDE_FILE_NAMES:
             files.append(rel_posix)
         return dirs, files
 
-    # دایرکتوری
-    for p in root.rglob("*"):
-        try:
-            rel = p.relative_to(repo_root)
-        except ValueError:
-            continue
-
-        rel_posix = _to_posix(rel)
-
-        # فیلتر دایرکتوری‌های ناخواسته
-        if p.is_dir():
-            if _is_excluded_dir(rel_posix + "/"):
-                continue
-            dirs.append(rel_posix)
+    # دایرکتوری: پیمایش غیربازگشتی با پشته؛ زیرشاخه‌های حذف‌شده اصلاً باز نمی‌شوند.
+    # مسیر نسبی تجمعی همراه پشته حمل می‌شود تا relpath (که خودش abspath و
+    # split صدا می‌زند) برای هیچ entry اجرا نشود — یک الحاق رشته کافی است
+    root_rel = os.path.relpath(str(root), repo_root).replace(os.sep, "/")
+    # خودِ ریشه همین‌جا seed می‌شود؛ main دیگر شاخه‌ی خاص root و sort مجدد ندارد
+    if root_rel != "." and not _is_excluded_dir(root_rel + "/"):
+        dirs.append(root_rel)
+    stack: list[tuple[str, str]] = [(str(root), "" if root_rel == "." else root_rel + "/")]
+
+    # bind محلی نام‌های داغ؛ داخل حلقه LOAD_GLOBAL/LOAD_ATTR تکرار نمی‌شود
+    list_dir = _list_dir_cached
+    excl_abs = _EXCL_ABS
+    excl_dir_names = EXCLUDE_DIR_NAMES
+    excl_file_names = EXCLUDE_FILE_NAMES
+    dirs_append = dirs.append
+    files_append = files.append
+    stack_pop = stack.pop
+    stack_append = stack.append
+
+    while stack:
+        current, rel_prefix = stack_pop()
+        listing = list_dir(current)
+        if listing is None:
             continue
-
-        # فایل
-        if p.is_file():
-            # اگر داخل مسیرهای حذف‌شده افتاد، رد کن
-            parent_posix = _to_posix(rel.parent)
-            if parent_posix and _is_excluded_dir(parent_posix + "/"):
+        dirnames, filenames = listing
+        for name in dirnames:
+            # اجداد این entry قبلاً از فیلتر رد شده‌اند؛ کافی است خودش
+            # جزو excludeهای مطلق یا نام‌های نویز نباشد
+            path = current + "/" + name
+            if path in excl_abs or name in excl_dir_names:
                 continue
-            if p.name in EXCLUDE_FILE_NAMES:
+            rel_posix = rel_prefix + name
+            dirs_append(rel_posix)
+            stack_append((path, rel_posix + "/"))
+        for name in filenames:
+            if name in excl_file_names:
                 continue
-            files.append(rel_posix)
+            files_append(rel_prefix + name)
 
     # مرتب‌سازی پایدار
     dirs = sorted(set(dirs))
@@ -98,38 +194,64 @@ def _walk_dirs_and_files(root: Path) -> tuple[list[str], list[str]]:
 
 def main() -> int:
     repo_root = Path(__file__).resolve().parent
+    _load_dir_cache()
 
-    all_dirs: list[str] = []
-    all_files: list[str] = []
+    dir_streams: list[list[str]] = []
+    file_streams: list[list[str]] = []
 
+    # یک stat برای هر ریشه به جای exists/is_file/is_dir جداگانه (هر کدام یک syscall)
+    targets: list[Path] = []
+    target_is_dir: list[bool] = []
     for item in INCLUDE_ROOTS:
-        target = repo_root / item
-        if not target.exists():
+        t = repo_root / item
+        try:
+            st = t.stat()
+        except OSError:
             continue
+        targets.append(t)
+        target_is_dir.append(stat.S_ISDIR(st.st_mode))
 
-        dirs, files = _walk_dirs_and_files(target)
-
-        # اگر خودِ ریشه یک دایرکتوری است، خودش را هم اضافه کن
-        if target.is_dir():
-            rel_root = _to_posix(target.relative_to(repo_root))
-            if rel_root and not _is_excluded_dir(rel_root + "/"):
-                all_dirs.append(rel_root)
-
-        all_dirs.extend(dirs)
-        all_files.extend(files)
-
-    all_dirs = sorted(set(all_dirs))
-    all_files = sorted(set(all_files))
+    # پیمایش ریشه‌ها مستقل و syscall-bound است؛ scandir/stat حین اجرا GIL را
+    # آزاد می‌کنند پس چند thread خواندن دایرکتوری‌ها را همپوشان می‌کند.
+    # ex.map ترتیب ریشه‌ها را حفظ می‌کند تا خروجی determinist بماند
+    with ThreadPoolExecutor(max_workers=min(4, len(targets)) or 1) as ex:
+        results = list(ex.map(_walk_dirs_and_files, targets, target_is_dir))
+    _save_dir_cache()
 
-    lines: list[str] = []
-    for d in all_dirs:
-        lines.append(f"d {TREE_BASE}/{d}")
-    for f in all_files:
-        lines.append(f"f {RAW_BASE}/{f}")
+    for dirs, files in results:
+        dir_streams.append(dirs)
+        file_streams.append(files)
 
     # خروجی دقیقاً در همان جایی که اسکریپت اجرا می‌شود (CWD)
+    # هر stream از قبل sort شده؛ heapq.merge خروجی سراسری مرتب را بدون
+    # ساختن یک لیست کل می‌دهد و dedupe فقط با خط قبلی مقایسه می‌شود
+    # هر خط یک بافر bytes است و هر ۱۰۲۴ خط با یک writev (زیر IOV_MAX لینوکس)
+    # به کرنل می‌رود؛ نه join کامل در حافظه، نه syscall به ازای هر خط
+    # اول روی tmp می‌نویسیم و بعد os.replace؛ اجرای نیمه‌کاره خروجی قبلی را خراب نمی‌کند
     out_path = Path.cwd() / "filelist.txt"
-    out_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    tmp_path = str(out_path) + ".tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        bufs: list[bytes] = []
+        last: str | None = None
+        for d in heapq.merge(*dir_streams):
+            if d != last:
+                bufs.append(_D_LINE_PREFIX + d.encode("utf-8") + b"\n")
+                last = d
+                if len(bufs) >= 1024:
+                    _writev_all(fd, bufs)
+        last = None
+        for f in heapq.merge(*file_streams):
+            if f != last:
+                bufs.append(_F_LINE_PREFIX + f.encode("utf-8") + b"\n")
+                last = f
+                if len(bufs) >= 1024:
+                    _writev_all(fd, bufs)
+        if bufs:
+            _writev_all(fd, bufs)
+    finally:
+        os.close(fd)
+    os.replace(tmp_path, out_path)
 
     print(str(out_path))
     return 0